@@ -1,25 +1,81 @@
 """rdw.py"""
 
-import datetime
-import filecmp
-import json
+import hashlib
 import os
 import re
 import sys
 from rdw_utils import (
+    FEATURE_58KWH,
+    FEATURE_63KWH,
+    FEATURE_AWD,
+    FEATURE_CONNECT,
+    FEATURE_CONNECTPLUS,
+    FEATURE_LOUNGE,
+    FEATURE_MODEL2022_5,
+    FEATURE_MODEL2023,
+    FEATURE_OLIVE,
+    FEATURE_PANORAMADAK,
+    FEATURE_PROJECT45,
+    FEATURE_V2L,
+    FEATURE_WP,
     arg_has,
+    arg_value,
     get_kentekens,
+    get_kentekens_delta,
+    get_models,
+    get_enrichment,
+    read_enrichment,
     fill_prices,
     get_variant,
     my_die,
+    iter_kentekens,
     safe_get_key,
     print_import_separate,
+    get_features,
+)
+from rdw_backup import get_backup_filename, store_backup
+from rdw_history import archive_snapshot, open_history
+from rdw_index import StateIndex, write_index
+from rdw_cache import get_classified_key, read_classified, write_classified
+from rdw_record import (
+    FLAG_EXPORT,
+    FLAG_NOG_NIET_OP_NAAM,
+    FLAG_TAXI,
+    KentekenRecord,
+    get_record_sort_key,
+)
+from rdw_state import (
+    STATE_INDEX,
+    STATE_VIEWS,
+    get_meta,
+    get_state_files,
+    open_state,
+    read_manifest,
+    read_state,
+    set_meta,
+    write_state,
 )
 
 sys.stdout.flush()  # Disable output buffering
 
 D = arg_has("debug")
 
+# RDW fields used by main(), other fields are not fetched
+FIELDS = [
+    "kenteken",
+    "datum_eerste_afgifte_nederland",
+    "datum_eerste_tenaamstelling_in_nederland",
+    "registratie_datum_goedkeuring_afschrijvingsmoment_bpm_dt",
+    "datum_eerste_toelating",
+    "eerste_kleur",
+    "catalogusprijs",
+    "variant",
+    "uitvoering",
+    "typegoedkeuringsnummer",
+    "taxi_indicator",
+    "export_indicator",
+]
+
 
 def dbg(line: str) -> bool:
     """print line if debugging"""
@@ -28,52 +84,123 @@ def dbg(line: str) -> bool:
     return D  # just to make a lazy evaluation expression possible
 
 
-def rename_with_timestamp(filename: str) -> str:
-    """rename with timestamp"""
-    new_filename = ""
-    if os.path.isfile(filename):
-        file_extension = os.path.splitext(filename)[1]
-        yyyymmdd_hhmmss = datetime.datetime.now().strftime("%Y.%m.%d_%H.%M.%S")
-        new_filename = f"{filename}.{yyyymmdd_hhmmss}{file_extension}"
-        os.rename(filename, new_filename)
-
-    print(f"INFO: Creating {filename}, backup={new_filename}")
-    return new_filename
-
-
-def delete_second_file_if_content_same(filename1: str, filename2: str):
-    """delete second file if content same"""
-    if filename2 != "" and filecmp.cmp(filename1, filename2, shallow=False):
-        print(f"INFO: Deleting {filename2}")
-        os.remove(filename2)
+def get_file_digest(state, filename: str) -> str:
+    """get digest of file, stored digest when size and mtime are unchanged"""
+    if not os.path.isfile(filename):
+        return ""
+    stat = os.stat(filename)
+    key = f"{stat.st_size} {stat.st_mtime_ns}"
+    stored = get_meta(state, f"digest {filename}").split(" ")
+    if " ".join(stored[:2]) == key:
+        return stored[2]
+    with open(filename, "r", encoding="utf8") as file:
+        digest = hashlib.sha256(file.read().encode("utf8")).hexdigest()
+    set_meta(state, f"digest {filename}", f"{key} {digest}")
+    return digest
+
+
+def is_state_file(state, filename: str) -> bool:
+    """file is as written by the last run, so the same as its rdw.db view"""
+    if not os.path.isfile(filename):
+        return False
+    stat = os.stat(filename)
+    stored = get_meta(state, f"digest {filename}").split(" ")
+    return " ".join(stored[:2]) == f"{stat.st_size} {stat.st_mtime_ns}"
+
+
+def get_state_index(state):
+    """get mmap index of the opnaam shards, None when not the rdw.db view"""
+    filenames = [shard["file"] for shard in read_manifest()["shards"]]
+    if not all(is_state_file(state, filename) for filename in filenames):
+        return None
+    index = StateIndex(STATE_INDEX)
+    if not index.is_valid() or index.filenames != filenames:
+        index.close()
+        return None
+    return index
+
+
+def write_state_files(state):
+    """write changed state files and opnaam shards, remove emptied shards"""
+    previous = [shard["file"] for shard in read_manifest()["shards"]]
+    files = get_state_files(state)
+    for filename, lines in files.items():
+        write_if_content_changed(state, filename, lines)
+    for filename in previous:
+        if filename not in files and os.path.isfile(filename):
+            print(
+                f"INFO: Removing {filename}, backup in {get_backup_filename(filename)}"
+            )
+            store_backup(filename, [])
+            os.remove(filename)
+    filenames = [shard["file"] for shard in read_manifest()["shards"]]
+    with StateIndex(STATE_INDEX) as index:
+        current = index.is_valid() and index.filenames == filenames
+    if not current:
+        write_index(filenames, STATE_INDEX)
+
+
+def write_if_content_changed(state, filename: str, lines: list):
+    """write lines with a backup, no rename and write when the digest is the same"""
+    content = "".join(f"{line}\n" for line in lines)
+    digest = hashlib.sha256(content.encode("utf8")).hexdigest()
+    if digest == get_file_digest(state, filename):
+        _ = D and dbg(f"INFO: Unchanged {filename}")
+        return
+    store_backup(filename, lines)
+    print(f"INFO: Creating {filename}, backup in {get_backup_filename(filename)}")
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename + ".tmp", "w", encoding="utf8") as file:
+        file.write(content)
+    os.replace(filename + ".tmp", filename)
+    stat = os.stat(filename)
+    set_meta(state, f"digest {filename}", f"{stat.st_size} {stat.st_mtime_ns} {digest}")
+
+
+# kleur -> colour name of print lines
+# GEEL  Gravity Gold (Mat)
+# ZWART Phantom Black (Mica Parelmoer)
+# GROEN Digital Teal (Mica Parelmoer), Mystic Olive (Mica)
+# BLAUW Lucid Blue (Mica Parelmoer)
+# BRUIN Mystic Olive (Mica)
+# GRIJS Shooting Star (Mat), Cyber Grey (Metal.), Galactic Gray (Metal.)
+# WIT   Atlas White (Solid) Atlas White Matte
+# ROOD  Ultimate Red Metallic
+PRINT_COLORS = {
+    "GEEL": "Gravity Gold",
+    "ZWART": "Phantom Black",
+    "ROOD": "Red Metallic",
+    "GROEN": "Digital Teal",
+    "BLAUW": "Lucid Blue",
+    "BRUIN": "Mystic Olive",
+    "GRIJS": "Cyber/Galactic",
+    "WIT": "Atlas White",
+}
+# (kleur, finish in variant label, colour name, finish removed from the label),
+# the first finish found in the label wins over PRINT_COLORS
+PRINT_FINISHES = (
+    ("GROEN", " (Olive)", "Mystic Olive", True),
+    ("GROEN", "Olive", "GROEN", False),
+    ("GRIJS", " (Shooting Star)", "Shooting Star", True),
+    ("GRIJS", "PROJECT45", "Shooting Star", False),
+    ("WIT", " (Atlas White Matte)", "White Matte", False),
+)
+# internal information, not interesting for end user
+PRINT_HIDDEN_TYPEGOEDKEURING = re.compile(r"e9\*2018/858\*11054\*0[13456789]")
+PRINT_HIDDEN_VARIANT = re.compile(r"[FA]5E..;E11.11")
 
 
 # ===============================================================================
-# get_print_line
-# parameter 1: line
-# format:
-#           1         2         3         4         5         6         7         8         9  # noqa
-# 01234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890
-# NDHN146DH 20210917 GRIJS      55600    F5E32;E11A11;e9*2018/858*11054*01; prijs: 55600 GRIJS     73 kWh Lounge  # noqa
-# return printLine
+# get_fixed_width_print_line
+# parameter 1: fixed-width special line of a kenteken record
+# return printLine, as cut from the special line before print lines were
+# rendered from the record fields
 # ===============================================================================
-def get_print_line(line):
-    """get_print_line"""
-    _ = D and dbg(f"getPrintLine({line})")
+def get_fixed_width_print_line(line: str) -> str:
+    """get_print_line for records outside the widths get_print_line formats"""
     new = line[3:19] + line[39:93] + line[97:]
     new = re.sub(r";e9\*2018\/858\*11054\*0[13456789];", "", new)
-
     new = new.replace("prijs: ", "E")
-
-    # Kleuren:
-    # GEEL  Gravity Gold (Mat)
-    # ZWART Phantom Black (Mica Parelmoer)
-    # GROEN Digital Teal (Mica Parelmoer), Mystic Olive (Mica)
-    # BLAUW Lucid Blue (Mica Parelmoer)
-    # BRUIN Mystic Olive (Mica)
-    # GRIJS Shooting Star (Mat), Cyber Grey (Metal.), Galactic Gray (Metal.)
-    # WIT   Atlas White (Solid) Atlas White Matte
-    # ROOD  Ultimate Red Metallic
     new = new.replace("GEEL  ", "Gravity Gold   ")
     new = new.replace("ZWART ", "Phantom Black  ")
     new = new.replace("ROOD ", "Red Metallic  ")
@@ -93,15 +220,89 @@ def get_print_line(line):
         new = new.replace("WIT   ", "White Matte    ")
     else:
         new = new.replace("WIT   ", "Atlas White    ")
-
-    # get rid of internal information too, not interesting for end user
     new = re.sub(r"F5E..;E11.11 ", "", new)
     new = re.sub(r"A5E..;E11.11 ", "", new)
-    _ = D and dbg(f"getPrintLine RESULT: [{new}]")
+    return new
+
 
+# ===============================================================================
+# get_print_line
+# parameter 1: kenteken record
+# format:
+#           1         2         3         4         5         6         7         8         9  # noqa
+# 01234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890
+# GDR15F 20210917 F5E32;E11A11;e9*2018/858*11054*02; E55600 Cyber/Galactic 73 kWh Lounge  # noqa
+# return printLine
+# ===============================================================================
+def get_print_line(record: KentekenRecord) -> str:
+    """get_print_line"""
+    if (
+        len(record.kenteken) != 6
+        or len(str(record.prijs)) != 5
+        or len(record.variant + record.uitvoering + record.typegoedkeuring) != 31
+    ):
+        # the format below assumes the widths of the special line the print
+        # line was cut from, other records keep the line the cut gave them
+        new = get_fixed_width_print_line(record.get_special_line())
+        _ = D and dbg(f"getPrintLine RESULT: [{new}]")
+        return new
+    label = record.label
+    color = PRINT_COLORS.get(record.kleur)
+    for kleur, finish, name, remove in PRINT_FINISHES:
+        if kleur == record.kleur and finish in label:
+            color = name
+            if remove:
+                label = label.replace(finish, "")
+            break
+    color = f"{color:<15}" if color else f"{record.kleur:<6.6}"
+
+    codes = f"{record.variant};{record.uitvoering}"
+    if not PRINT_HIDDEN_TYPEGOEDKEURING.fullmatch(record.typegoedkeuring):
+        codes += f";{record.typegoedkeuring}; "
+    elif PRINT_HIDDEN_VARIANT.fullmatch(codes):
+        codes = ""
+    else:
+        codes += " "
+    new = (
+        f"{record.kenteken} {record.date} {codes}E{record.prijs} {color}"
+        f"{label}{record.get_suffix()}"
+    )
+    _ = D and dbg(f"getPrintLine RESULT: [{new}]")
     return new
 
 
+# ===============================================================================
+# print_enrichment
+# parameter 1: enrichment cache from get_enrichment
+# parameter 2: kentekens to print the statistics for
+# ===============================================================================
+def print_enrichment(enrichment: dict, kentekens: list):
+    """print vermogen and actieradius statistics of the enrichment cache"""
+    vermogens = {}
+    actieradiussen = {}
+    count = 0
+    for k in kentekens:
+        for row in enrichment.get(k, {}).get("8ys7-d773", [])[:1]:
+            count += 1
+            vermogen = safe_get_key(row, "nettomaximumvermogen")
+            vermogens[vermogen] = vermogens.get(vermogen, 0) + 1
+            actieradius = safe_get_key(row, "actie_radius_enkel_elektrisch_wltp")
+            actieradiussen[actieradius] = actieradiussen.get(actieradius, 0) + 1
+    if count == 0:
+        return
+
+    for vermogen in sorted(vermogens, key=lambda v: float(v or 0)):
+        pvermogen = vermogens[vermogen] / count * 100
+        print(f"{pvermogen:4.1f} % {vermogen} kW ({vermogens[vermogen]} maal)")
+    print()
+    for actieradius in sorted(actieradiussen, key=lambda v: float(v or 0)):
+        pactieradius = actieradiussen[actieradius] / count * 100
+        print(
+            f"{pactieradius:4.1f} % {actieradius} km WLTP actieradius ({actieradiussen[actieradius]} maal)"  # noqa
+        )
+    print()
+
+
 def main():
     """main"""
 
@@ -191,50 +392,62 @@ def main():
     nognietopnaam = []
     opnaam = []
 
-    nognietopnaam_dict = {}
-    if os.path.isfile("nognietopnaam.txt"):
-        with open("nognietopnaam.txt", "r", encoding="utf8") as nognietopnaamfile:
-            for line in nognietopnaamfile:
-                mstr = line.rstrip("\n")
-                k = mstr[:6]
-                if k != "":
-                    _ = D and dbg(f"Adding nognietopnaam: [{k}]")
-                    nognietopnaam_dict[k] = mstr
-
-    opnaam_dict = {}
-    if os.path.isfile("opnaam.txt"):
-        with open("opnaam.txt", "r", encoding="utf8") as opnaamfile:
-            for line in opnaamfile:
-                mstr = line.rstrip("\n")
-                k = mstr[:6]
-                if k != "":
-                    _ = D and dbg(f"Adding opnaam: [{k}]")
-                    opnaam_dict[k] = mstr
-
-    exported_dict = {}
-    if os.path.isfile("exported.txt"):
-        with open("exported.txt", "r", encoding="utf8") as exportedfile:
-            for line in exportedfile:
-                mstr = line.rstrip("\n")
-                k = mstr[:6]
-                if k != "":
-                    _ = D and dbg(f"Adding exported: [{k}]")
-                    exported_dict[k] = mstr
+    # state of the previous run, the state files are imported in rdw.db once
+    state = open_state()
+    nognietopnaam_dict = read_state(state, "nognietopnaam")
+    # only membership of opnaam is needed, the index avoids loading all lines
+    opnaam_index = get_state_index(state)
+    opnaam_dict = opnaam_index
+    if opnaam_index is None:
+        opnaam_dict = read_state(state, "opnaam")
+    exported_dict = read_state(state, "exported")
+    _ = D and dbg(f"State: {len(opnaam_dict)} opnaam, {len(exported_dict)} exported")
 
     xkentekensfilename = "x.kentekens"
-    if not summary and not overview:
-        print("Getting IONIQ5 kentekens")
-        if os.path.exists(xkentekensfilename):
-            os.remove(xkentekensfilename)
-            get_kentekens()
+    classified_key = get_classified_key(
+        xkentekensfilename,
+        [get_meta(state, f"digest {filename}") for filename in STATE_VIEWS],
+        pricelists,
+        D,
+    )
+    cached = None
+    if (summary or overview) and not arg_has("nocache"):
+        # classification of the last default run, when nothing changed since
+        cached = read_classified(classified_key)
+
+    compress = arg_has("compress")
+    models = arg_value("models")
+    if cached is not None:
+        kentekens = []
+    elif models != "" and not summary and not overview:
+        # IONIQ5 and the other models at the same time, each in its own snapshot
+        models = ["IONIQ5"] + [m for m in models.split(",") if m not in ("", "IONIQ5")]
+        print(f"Getting {', '.join(models)} kentekens")
+        get_models(models, FIELDS, compress, arg_has("delta"))
+        kentekens = iter_kentekens(xkentekensfilename, FIELDS)
+    elif not summary and not overview:
+        if arg_has("delta"):
+            print("Getting changed IONIQ5 kentekens")
+            kentekens = get_kentekens_delta(
+                xkentekensfilename, fields=FIELDS, compress=compress
+            )
+        else:
+            print("Getting IONIQ5 kentekens")
+            kentekens = get_kentekens(
+                xkentekensfilename, fields=FIELDS, compress=compress
+            )
+    else:
+        kentekens = iter_kentekens(xkentekensfilename, FIELDS)
     print("Processing IONIQ5 kentekens")
-    with open(xkentekensfilename, encoding="utf8") as json_file:
-        json_data = json.load(json_file)
 
-    aantal_kentekens = len(json_data)
-    print(f"Aantal kentekens: {aantal_kentekens}")
-    for hash_ in json_data:
+    # kentekens are processed one by one while being read or downloaded
+    aantal_kentekens = 0
+    kenteken_list = []
+    print_lines = {}  # kenteken -> print line, rendered once
+    for hash_ in kentekens:
+        aantal_kentekens += 1
         k = hash_["kenteken"]
+        kenteken_list.append(k)
         _ = D and dbg(f"kenteken = [{k}]")
 
         gekend_op_naam = False
@@ -323,7 +536,6 @@ def main():
             "ROOD",
         ]:
             my_die(f"{k} Kleur onbekend: [{kleur}]")
-        kleur = kleur.ljust(10)
 
         prijs = safe_get_key(hash_, "catalogusprijs")
         if not prijs and kenteken != "R296FL":
@@ -405,7 +617,24 @@ def main():
         ]:
             my_die(f"ERROR: {k} Typegoedkeuring verkeerd: [{typegoedkeuring}] {hash_}")
 
-        cartype = f"{variant};{uitvoering};{typegoedkeuring}; prijs: {prijs} {kleur}"
+        if not (date + date_bpm).isdigit():
+            my_die(f"{k} Date fout: [{date}] [{date_bpm}]")
+        record = KentekenRecord(
+            kenteken,
+            int(date),
+            date_toelating,
+            int(date_bpm or 0),
+            kleur,
+            int(prijs),
+            variant,
+            uitvoering,
+            typegoedkeuring,
+        )
+        if taxi == "Ja":
+            record.flags |= FLAG_TAXI
+        if gekend_niet_op_naam or nieuw_niet_op_naam:
+            record.flags |= FLAG_NOG_NIET_OP_NAAM
+        cartype = record.get_cartype()
         date20 = date_toelating.replace(
             "??", "20"
         )  # nog niet op naam date can start with ??
@@ -460,16 +689,12 @@ def main():
 
         if value == "ERROR":
             my_die(f"{k} ERROR occurred")
-        cartype += value
-        if date != date_toelating:
-            cartype += f" ({date_toelating} geimporteerd {date})"
-        elif date_bpm != "":
-            cartype += f" (aanvraag kenteken {date_bpm})"
-        if gekend_niet_op_naam or nieuw_niet_op_naam:
-            cartype += " (nog niet op naam)"
-        special_kenteken = f"{kenteken[0]}{kenteken[4:6]}{kenteken} {date} {kleur} {prijs}    {cartype}"  # noqa
-        _ = D and print(special_kenteken)
-        tmp = get_print_line(special_kenteken)
+        record.label = value
+        if export == "Ja":
+            record.flags |= FLAG_EXPORT
+        _ = D and print(record.get_special_line())
+        tmp = get_print_line(record)
+        print_lines[k] = tmp
         if export == "Ja":
             if k not in exported_dict:
                 nieuw_export_list.append(tmp)
@@ -494,47 +719,75 @@ def main():
             opnaam.append(tmp)
             print(f"Nieuw kenteken op naam: {k} {tmp}")
             nieuw_op_naam_list.append(f"{tmp}")
-        alle_kentekens.append(special_kenteken)
+        alle_kentekens.append(record)
+    if opnaam_index is not None:
+        opnaam_index.close()  # the index is rewritten when the shards change
+
+    if cached is not None:
+        alle_kentekens, counters = cached
+        for record in alle_kentekens:
+            aantal_kentekens += 1
+            kenteken_list.append(record.kenteken)
+            tmp = get_print_line(record)
+            print_lines[record.kenteken] = tmp
+            if record.flags & FLAG_TAXI:
+                counttaxi += 1
+            if record.flags & FLAG_NOG_NIET_OP_NAAM:
+                nognietopnaam.append(tmp)
+                count_nog_niet_op_naam += 1
+            else:
+                opnaam.append(tmp)
+        count20inch = counters["count20inch"]
+        countlounge20inch = counters["countlounge20inch"]
+        count19inch = counters["count19inch"]
+        countlounge19inch = counters["countlounge19inch"]
+        colormatte = counters["colormatte"]
+        colormica = counters["colormica"]
+        colorsolid = counters["colorsolid"]
+        colormicapearl = counters["colormicapearl"]
+        colormetallic = counters["colormetallic"]
+        variantscount = counters["variantscount"]
+        variantscountnognietopnaam = counters["variantscountnognietopnaam"]
+        geimporteerd = counters["geimporteerd"]
 
-    countexport = 0
-    sorted_exported = sorted(
-        exported_dict.values(),
-        key=lambda s: (s[7:], s[0:1], s[4:6], s[1:]),
-        reverse=True,
-    )
-    for values in sorted_exported:
-        countexport += 1
-    if not summary and not overview:
-        new_filename = rename_with_timestamp("exported.txt")
-        with open("exported.txt", "x", encoding="utf8") as exportedtxtfile:
-            for values in sorted_exported:
-                exportedtxtfile.write(f"{values}\n")
-        delete_second_file_if_content_same("exported.txt", new_filename)
-
-    importnietopnaam = 0
-    sorted_nog_niet_op_naam = sorted(
-        nognietopnaam, key=lambda s: (s[7:], s[0:1], s[4:6], s[1:]), reverse=True
-    )
-    for string in sorted_nog_niet_op_naam:
-        if "geimporteerd" in string:
-            importnietopnaam += 1
-    if not summary and not overview:
-        new_filename = rename_with_timestamp("nognietopnaam.txt")
-        with open("nognietopnaam.txt", "x", encoding="utf8") as nognietopnaamtxtfile:
-            for string in sorted_nog_niet_op_naam:
-                string = string.replace(" (nog niet op naam)", "")
-                nognietopnaamtxtfile.write(f"{string}\n")
-        delete_second_file_if_content_same("nognietopnaam.txt", new_filename)
+    print(f"Aantal kentekens: {aantal_kentekens}")
+
+    if arg_has("enrich") and not summary and not overview:
+        print("Getting IONIQ5 brandstof and carrosserie")
+        get_enrichment(kenteken_list)
+
+    countexport = len(exported_dict)
+    importnietopnaam = sum(1 for string in nognietopnaam if "geimporteerd" in string)
 
     if not summary and not overview:
-        new_filename = rename_with_timestamp("opnaam.txt")
-        with open("opnaam.txt", "x", encoding="utf8") as opnaamtxtfile:
-            sorted_op_naam = sorted(
-                opnaam, key=lambda s: (s[7:], s[0:1], s[4:6], s[1:]), reverse=True
-            )
-            for string in sorted_op_naam:
-                opnaamtxtfile.write(f"{string}\n")
-        delete_second_file_if_content_same("opnaam.txt", new_filename)
+        # only changed kentekens and changed state files are written
+        write_state(state, opnaam, nognietopnaam, exported_dict)
+        write_state_files(state)
+        counters = {
+            "count20inch": count20inch,
+            "countlounge20inch": countlounge20inch,
+            "count19inch": count19inch,
+            "countlounge19inch": countlounge19inch,
+            "colormatte": colormatte,
+            "colormica": colormica,
+            "colorsolid": colorsolid,
+            "colormicapearl": colormicapearl,
+            "colormetallic": colormetallic,
+            "variantscount": variantscount,
+            "variantscountnognietopnaam": variantscountnognietopnaam,
+            "geimporteerd": geimporteerd,
+        }
+        classified_key = get_classified_key(
+            xkentekensfilename,
+            [get_meta(state, f"digest {filename}") for filename in STATE_VIEWS],
+            pricelists,
+            D,
+        )
+        write_classified(classified_key, alle_kentekens, counters)
+        history = open_history()
+        archive_snapshot(history, xkentekensfilename)
+        history.close()
+    state.close()
 
     if summary:
         print(
@@ -543,67 +796,73 @@ def main():
         )
         print("[code]")
 
+    # one pass: every counter and every view is filled per kenteken
     alle_kentekens_print = []
-    for k in sorted(alle_kentekens, reverse=True):
+    op_taxi = []
+    op_export = []
+    op_naam_per_maand = {}
+    for record in sorted(alle_kentekens, key=get_record_sort_key, reverse=True):
         count += 1
-        print_line = get_print_line(k)
+        print_line = print_lines[record.kenteken]
         alle_kentekens_print.append(print_line)
-
-    for k in sorted(alle_kentekens, reverse=True):
-        print_line = get_print_line(k)
+        if "(Taxi)" in print_line:
+            op_taxi.append(print_line)
+        if "(geexporteerd)" in print_line:
+            op_export.append(print_line)
+        if record.kenteken not in nognietopnaam_dict:
+            op_naam_per_maand.setdefault(print_line[7:13], []).append(print_line)
         if summary:
             print(f"{print_line}")
-        if not re.search(r"AWD", print_line, re.IGNORECASE) and not re.search(
-            r"PROJECT45", print_line, re.IGNORECASE
-        ):
+        features, trim = get_features(print_line)
+        if not features & (FEATURE_AWD | FEATURE_PROJECT45):
             rwd += 1
-        if re.search(r"Model 2023", print_line, re.IGNORECASE):
+        if features & FEATURE_MODEL2023:
             model2023 += 1
-        elif re.search(r"Model 2022\.5", print_line, re.IGNORECASE):
+        elif features & FEATURE_MODEL2022_5:
             model2022_5 += 1
         else:
             model2022 += 1
-        if not re.search(r"58 kWh", print_line, re.IGNORECASE) and not re.search(
-            r"63 kWh", print_line, re.IGNORECASE
-        ):
+        if not features & (FEATURE_58KWH | FEATURE_63KWH):
             longrangebattery += 1
-        if re.search(r"V2L|PROJECT45|Lounge|Connect", print_line, re.IGNORECASE):
+        if features & (
+            FEATURE_V2L | FEATURE_PROJECT45 | FEATURE_LOUNGE | FEATURE_CONNECT
+        ):
             v2l += 1
-        if re.search(r"WP|PROJECT45|Lounge|Connect\+", print_line, re.IGNORECASE):
-            warmtepomp += 1
-        if re.search(r"Panoramadak", print_line, re.IGNORECASE) and not re.search(
-            r"Olive", print_line
+        if features & (
+            FEATURE_WP | FEATURE_PROJECT45 | FEATURE_LOUNGE | FEATURE_CONNECTPLUS
         ):
+            warmtepomp += 1
+        if features & FEATURE_PANORAMADAK and not features & FEATURE_OLIVE:
             panoramadak += 1
-        if re.search(r"PROJECT45", print_line, re.IGNORECASE):
+        if trim == "PROJECT45":
             solardak += 1
             project45 += 1
-        elif re.search(r"Zonnepanelen", print_line, re.IGNORECASE):
+        elif trim == "Zonnepanelen":
             solardak += 1
-        elif re.search(r"LOUNGE", print_line, re.IGNORECASE):
+        elif trim == "Lounge":
             lounge += 1
-        elif re.search(r"CONNECT\+", print_line, re.IGNORECASE):
+        elif trim == "Connect+":
             connectplus += 1
-        elif re.search(r"CONNECT", print_line, re.IGNORECASE):
+        elif trim == "Connect":
             connect += 1
-        elif re.search(r"STYLE", print_line, re.IGNORECASE):
+        elif trim == "Style":
             style += 1
-        elif re.search(r"N LINE EDITION", print_line, re.IGNORECASE):
+        elif trim == "N Line Edition":
             nlineedition += 1
-        elif re.search(r"N LINE", print_line, re.IGNORECASE):
+        elif trim == "N Line":
             nline += 1
         else:
-            my_die(f"ERROR: Model niet gevonden: [{k}][{print_line}]")
+            my_die(f"ERROR: Model niet gevonden: [{record.kenteken}][{print_line}]")
 
-        if "(nog niet op naam)" not in print_line:
-            date = k[10:16]
+        if not record.flags & FLAG_NOG_NIET_OP_NAAM:
+            date = record.get_month()
             if date.startswith("2"):
                 if date in dates:
                     dates[date] += 1
                 else:
                     dates[date] = 1
 
-        color = k[19:29].rstrip()
+        color = record.kleur
         _ = D and dbg(f"KLEUR=[{color}]")
         if color in colors:
             colors[color] += 1
@@ -615,19 +874,14 @@ def main():
 
     if overview:
         print("\n\n[h1]Kentekens gesorteerd op kleur/uitvoering/datum[/h1]\n[code]")
-        op_all = []
-        for print_line in alle_kentekens_print:
-            op_all.append(print_line)
-        sorted_all = sorted(op_all, key=lambda x: (x[23:], x[7:], x[0], x[4:6], x[1:]))
+        sorted_all = sorted(
+            alle_kentekens_print, key=lambda x: (x[23:], x[7:], x[0], x[4:6], x[1:])
+        )
         for string in sorted_all:
             print(string)
 
         print("[/code]\n")
         print("\n\n[h1]Taxi's gesorteerd op kleur/uitvoering/datum[/h1]\n[code]")
-        op_taxi = []
-        for print_line in alle_kentekens_print:
-            if "(Taxi)" in print_line:
-                op_taxi.append(print_line)
         sorted_taxi = sorted(
             op_taxi, key=lambda x: (x[23:], x[7:9], x[0], x[4:6], x[1:])
         )
@@ -638,10 +892,6 @@ def main():
 
         print("\n\n[h1]geexporteerd gesorteerd op kleur/uitvoering/datum[/h1]")
         print("[code]")
-        op_export = []
-        for print_line in alle_kentekens_print:
-            if "(geexporteerd)" in print_line:
-                op_export.append(print_line)
         sorted_export = sorted(
             op_export, key=lambda a: (a[23:], a[7:10], a[0], a[4:6], a[1:])
         )
@@ -666,16 +916,7 @@ def main():
             f"\n\n[h1]Kentekens op naam in {maandstring} {jaar}, kleur/uitvoering[/h1]"  # noqa
         )
         print("[code]")
-        op_naam = []
-        for print_line in alle_kentekens_print:
-            kenteken = print_line[0:6]
-            _ = D and dbg(f"kenteken={kenteken} print_line=[{print_line}]")
-            if kenteken not in nognietopnaam_dict:
-                date = print_line[7:13]
-                if date == key:
-                    _ = D and dbg(print_line)
-                    op_naam.append(print_line)
-        sorted_opnaam = sorted(op_naam, key=lambda a: a[23:])
+        sorted_opnaam = sorted(op_naam_per_maand.get(key, []), key=lambda a: a[23:])
         for string in sorted_opnaam:
             print(string)
         print("[/code]\n")
@@ -860,6 +1101,9 @@ def main():
         print(f"{ptaxi:4.1f} % Taxi ({counttaxi} maal)")
         print()
 
+        if arg_has("enrich"):
+            print_enrichment(read_enrichment("x.enrichment"), kenteken_list)
+
         p19 = count19inch / count * 100
         p20 = count20inch / count * 100
         lounge_count = countlounge19inch + countlounge20inch
@@ -934,4 +1178,5 @@ def main():
             print()
 
 
-main()
+if __name__ == "__main__":
+    main()
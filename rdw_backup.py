@@ -0,0 +1,232 @@
+"""rdw_backup.py"""
+
+from datetime import datetime, timedelta
+import difflib
+import gzip
+import json
+import os
+import sys
+from rdw_utils import arg_has, arg_value, my_die
+
+sys.stdout.flush()  # Disable output buffering
+
+# every version of a state file in one gzip file of json records, the first
+# record is the full base, every next record (an appended gzip member) the
+# line-level delta with the version before it
+BACKUP_DIR = "backup"
+BACKUP_DAILY_DAYS = 30  # one version per day, older one version per week
+BACKUP_KEEP_VERSIONS = 10  # latest versions always kept, also of the same day
+BACKUP_USAGE = (
+    "python rdw_backup.py list [file=opnaam/202502.txt]   versions of a state file\n"
+    "python rdw_backup.py restore [file=nognietopnaam.txt] time=2025-01-01"
+    "   version at time\n"
+    "python rdw_backup.py compact [days=30]   apply the retention policy now"
+)
+
+
+# ===============================================================================
+# get_backup_filename
+# parameter 1: state file
+# ===============================================================================
+def get_backup_filename(filename: str) -> str:
+    """get backup store of state file"""
+    return os.path.join(BACKUP_DIR, f"{filename}.gz")
+
+
+# ===============================================================================
+# get_delta
+# parameter 1: lines of previous version
+# parameter 2: lines of new version
+# ===============================================================================
+def get_delta(old: list, new: list) -> list:
+    """get changed line ranges: [start, end, replacement lines]"""
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    return [
+        [i1, i2, new[j1:j2]]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+# ===============================================================================
+# apply_delta
+# parameter 1: lines of previous version
+# parameter 2: changed line ranges from get_delta
+# ===============================================================================
+def apply_delta(old: list, delta: list) -> list:
+    """get new version from previous version and delta"""
+    new = []
+    position = 0
+    for start, end, lines in delta:
+        new.extend(old[position:start])
+        new.extend(lines)
+        position = end
+    new.extend(old[position:])
+    return new
+
+
+# ===============================================================================
+# iter_versions
+# parameter 1: state file
+# ===============================================================================
+def iter_versions(filename: str):
+    """yield (time, lines) of every version in the backup store, oldest first"""
+    backup_filename = get_backup_filename(filename)
+    if not os.path.isfile(backup_filename):
+        return
+    lines = []
+    with gzip.open(backup_filename, "rt", encoding="utf8") as file:
+        for record in file:
+            record = json.loads(record)
+            if "lines" in record:
+                lines = record["lines"]
+            else:
+                lines = apply_delta(lines, record["delta"])
+            yield record["time"], lines
+
+
+# ===============================================================================
+# write_versions
+# parameter 1: state file
+# parameter 2: iterable of (time, lines), oldest first
+# ===============================================================================
+def write_versions(filename: str, versions):
+    """rewrite backup store with a base and deltas"""
+    backup_filename = get_backup_filename(filename)
+    previous = None
+    with gzip.open(backup_filename + ".tmp", "wt", encoding="utf8") as file:
+        for time, lines in versions:
+            if previous is None:
+                record = {"time": time, "lines": lines}
+            else:
+                record = {"time": time, "delta": get_delta(previous, lines)}
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            previous = lines
+    os.replace(backup_filename + ".tmp", backup_filename)
+
+
+# ===============================================================================
+# store_backup
+# parameter 1: state file
+# parameter 2: lines of the new version
+# ===============================================================================
+def store_backup(filename: str, lines: list):
+    """add new version of state file to its backup store"""
+    os.makedirs(os.path.dirname(get_backup_filename(filename)), exist_ok=True)
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    previous = None
+    for _, previous in iter_versions(filename):
+        pass
+    if previous is None:
+        # new store, starting with the current state file when there is one
+        versions = []
+        if os.path.isfile(filename):
+            with open(filename, "r", encoding="utf8") as file:
+                current = file.read().splitlines()
+            mtime = datetime.fromtimestamp(os.path.getmtime(filename))
+            versions.append((mtime.strftime("%Y-%m-%d %H:%M:%S"), current))
+        write_versions(filename, versions + [(now, lines)])
+        return
+
+    # append a gzip member with only the delta
+    record = {"time": now, "delta": get_delta(previous, lines)}
+    with gzip.open(get_backup_filename(filename), "at", encoding="utf8") as file:
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    compact_backup(filename, BACKUP_DAILY_DAYS)
+
+
+# ===============================================================================
+# get_retained_versions
+# parameter 1: version times, oldest first
+# parameter 2: days with one version per day, one version per week before
+# ===============================================================================
+def get_retained_versions(times: list, days: int) -> set:
+    """get the versions to keep: the latest ones, the last of each day or week"""
+    daily_from = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    last = {}
+    for version, time in enumerate(times):
+        if time >= daily_from:
+            period = time[:10]
+        else:
+            period = datetime.strptime(time[:10], "%Y-%m-%d").isocalendar()[:2]
+        last[period] = version
+    latest = range(max(len(times) - BACKUP_KEEP_VERSIONS, 0), len(times))
+    return set(last.values()) | set(latest)
+
+
+# ===============================================================================
+# compact_backup
+# parameter 1: state file
+# parameter 2: days with one version per day, one version per week before
+# ===============================================================================
+def compact_backup(filename: str, days: int):
+    """drop versions not kept by the retention policy"""
+    times = [time for time, _ in iter_versions(filename)]
+    retained = get_retained_versions(times, days)
+    if len(retained) == len(times):
+        return
+    write_versions(
+        filename,
+        (
+            version
+            for number, version in enumerate(iter_versions(filename))
+            if number in retained
+        ),
+    )
+    print(f"INFO: Compacted {filename} backup from {len(times)} to {len(retained)}")
+
+
+# ===============================================================================
+# get_backup_files
+# ===============================================================================
+def get_backup_files() -> list:
+    """get the state files with a backup store"""
+    filenames = []
+    for directory, _, names in os.walk(BACKUP_DIR):
+        for name in sorted(names):
+            if name.endswith(".gz"):
+                path = os.path.join(directory, name[:-3])
+                filenames.append(os.path.relpath(path, BACKUP_DIR))
+    return filenames
+
+
+# ===============================================================================
+# restore_backup
+# parameter 1: state file
+# parameter 2: time yyyy-mm-dd[ hh:mm:ss]
+# ===============================================================================
+def restore_backup(filename: str, time: str) -> list:
+    """get the lines of the state file version at time"""
+    restored = None
+    for version_time, lines in iter_versions(filename):
+        if version_time > time:
+            break
+        restored = lines
+    if restored is None:
+        my_die(f"No backup of {filename} at {time}")
+    return restored
+
+
+def main():
+    """main"""
+    filename = arg_value("file") or "nognietopnaam.txt"
+    if arg_has("list"):
+        previous = []
+        for time, lines in iter_versions(filename):
+            delta = get_delta(previous, lines)
+            removed = sum(end - start for start, end, _ in delta)
+            added = sum(len(new) for _, _, new in delta)
+            print(f"{time} {len(lines):6d} regels (+{added} -{removed})")
+            previous = lines
+    elif arg_has("restore"):
+        for line in restore_backup(filename, arg_value("time") or "9999"):
+            print(line)
+    elif arg_has("compact"):
+        for filename in get_backup_files():
+            compact_backup(filename, int(arg_value("days") or BACKUP_DAILY_DAYS))
+    else:
+        print(BACKUP_USAGE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""rdw_bench.py"""
+
+import gzip
+import io
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+import rdw_utils
+from rdw_utils import (
+    RDW_DATASET,
+    RDW_WHERE,
+    arg_value,
+    get_rdw_url,
+    get_select,
+    http_get,
+    log,
+    parse_csv,
+)
+import rdw_server
+from rdw import FIELDS
+
+sys.stdout.flush()  # Disable output buffering
+
+# "python rdw_bench.py fixture=x.kentekens repeat=5" compares the json and csv
+# ingestion of all IONIQ5 pages served by rdw_server.py (synthetic without fixture)
+REPEAT = int(arg_value("repeat") or 5)
+
+
+# ===============================================================================
+# get_page_urls
+# parameter 1: json or csv
+# ===============================================================================
+def get_page_urls(fmt: str, count: int) -> list:
+    """get urls of all kentekens pages like get_kentekens"""
+    return [
+        get_rdw_url(
+            RDW_DATASET,
+            {
+                "$select": get_select(FIELDS),
+                "$order": "`:id` ASC",
+                "$limit": rdw_utils.RDW_PAGE_SIZE,
+                "$offset": offset,
+                "$where": RDW_WHERE,
+            },
+            fmt,
+        )
+        for offset in range(0, count, rdw_utils.RDW_PAGE_SIZE)
+    ]
+
+
+# ===============================================================================
+# bench
+# parameter 1: json or csv
+# parameter 2: function parsing a decompressed body stream into rows
+# ===============================================================================
+def bench(fmt: str, parse, count: int) -> tuple:
+    """get wire bytes, body bytes, best fetch+parse and parse seconds, rows"""
+    urls = get_page_urls(fmt, count)
+    wire = 0
+    bodies = []
+    for url in urls:
+        _, _, headers, body = http_get(url, {"Accept-Encoding": "gzip"})
+        wire += len(body)
+        if headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        bodies.append(body)
+
+    fetch_seconds = parse_seconds = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for url in urls:
+            http_get(url, {"Accept-Encoding": "gzip"}, parse)
+        fetch_seconds = min(fetch_seconds, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        rows = [row for body in bodies for row in parse(io.BytesIO(body))]
+        parse_seconds = min(parse_seconds, time.perf_counter() - start)
+    return wire, sum(len(body) for body in bodies), fetch_seconds, parse_seconds, rows
+
+
+def main():
+    """main"""
+    rdw_server.load_datasets(arg_value("fixture"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), rdw_server.RdwHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rdw_utils.RDW_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    count = len(rdw_server.DATASETS[RDW_DATASET])
+    log(f"Benchmarking {count} kentekens, best of {REPEAT}")
+
+    results = {}
+    for fmt, parse in (("json", json.load), ("csv", parse_csv)):
+        results[fmt] = bench(fmt, parse, count)
+        wire, size, fetch_seconds, parse_seconds, _ = results[fmt]
+        print(
+            f"{fmt:4s}: {wire:9d} bytes gzip, {size:9d} bytes,"
+            f" fetch+parse {fetch_seconds:6.3f}s, parse {parse_seconds:6.3f}s"
+        )
+    same = results["json"][4] == results["csv"][4]
+    print(f"csv rows same as json rows: {'yes' if same else 'NO'}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
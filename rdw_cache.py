@@ -0,0 +1,138 @@
+"""rdw_cache.py"""
+
+from array import array
+import hashlib
+import json
+import os
+from rdw_record import KentekenRecord
+
+# classified kentekens of the last default run as columns, so summary and
+# overview can skip reading x.kentekens and get_variant
+CLASSIFIED_FILE = "x.classified"
+CLASSIFIED_VERSION = 1
+CLASSIFIED_CODES = (
+    "date_toelating",
+    "kleur",
+    "variant",
+    "uitvoering",
+    "typegoedkeuring",
+    "label",
+)
+# sources of the classification, a change in them invalidates the cache
+CLASSIFIED_SOURCES = ("rdw.py", "rdw_utils.py", "rdw_record.py")
+
+
+# ===============================================================================
+# get_classified_key
+# parameter 1: snapshot filename
+# parameter 2: state digests, changing whenever the state files change
+# parameter 3: pricelists of fill_prices
+# parameter 4: debug mode, get_variant labels then have the typegoedkeuring
+# ===============================================================================
+def get_classified_key(
+    filename: str, digests: list, pricelists: dict, debug: bool
+) -> str:
+    """get key of snapshot, state and classification the records were made with"""
+    if not os.path.isfile(filename):
+        return ""
+    stat = os.stat(filename)
+    # a changed pricelist, get_variant or debug mode classifies differently
+    logic = hashlib.sha256(
+        json.dumps([pricelists, debug], sort_keys=True).encode("utf8")
+    )
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for source in CLASSIFIED_SOURCES:
+        with open(os.path.join(directory, source), "rb") as file:
+            logic.update(file.read())
+    return " ".join(
+        [str(stat.st_size), str(stat.st_mtime_ns), logic.hexdigest()] + digests
+    )
+
+
+# ===============================================================================
+# write_classified
+# parameter 1: key from get_classified_key
+# parameter 2: kenteken records
+# parameter 3: counters of main() and get_variant
+# ===============================================================================
+def write_classified(key: str, records: list, counters: dict):
+    """write kenteken records as columns, nothing when not representable"""
+    columns = {
+        "kenteken": bytearray(),
+        "date": array("I"),
+        "date_bpm": array("I"),
+        "prijs": array("l"),
+        "flags": array("B"),
+    }
+    for name in CLASSIFIED_CODES:
+        columns[name] = array("I")
+    codes = {}
+    for record in records:
+        if len(record.kenteken) != 6 or not record.kenteken.isascii():
+            if os.path.isfile(CLASSIFIED_FILE):
+                os.remove(CLASSIFIED_FILE)
+            return
+        columns["kenteken"] += record.kenteken.encode("ascii")
+        for name in ("date", "date_bpm", "prijs", "flags"):
+            columns[name].append(getattr(record, name))
+        for name in CLASSIFIED_CODES:
+            columns[name].append(codes.setdefault(getattr(record, name), len(codes)))
+
+    header = {
+        "version": CLASSIFIED_VERSION,
+        "key": key,
+        "count": len(records),
+        "codes": list(codes),
+        "counters": counters,
+        "columns": [
+            [name, getattr(column, "typecode", "")] for name, column in columns.items()
+        ],
+    }
+    with open(CLASSIFIED_FILE + ".tmp", "wb") as file:
+        file.write(json.dumps(header, ensure_ascii=False).encode("utf8") + b"\n")
+        for column in columns.values():
+            file.write(bytes(column))
+    os.replace(CLASSIFIED_FILE + ".tmp", CLASSIFIED_FILE)
+
+
+# ===============================================================================
+# read_classified
+# parameter 1: key from get_classified_key
+# ===============================================================================
+def read_classified(key: str):
+    """get (kenteken records, counters), None when not current"""
+    if key == "" or not os.path.isfile(CLASSIFIED_FILE):
+        return None
+    columns = {}
+    with open(CLASSIFIED_FILE, "rb") as file:
+        header = json.loads(file.readline())
+        if header["version"] != CLASSIFIED_VERSION or header["key"] != key:
+            return None
+        count = header["count"]
+        for name, typecode in header["columns"]:
+            if typecode == "":  # kenteken, 6 bytes each
+                columns[name] = file.read(count * 6)
+                continue
+            columns[name] = array(typecode)
+            columns[name].frombytes(file.read(count * columns[name].itemsize))
+    codes = header["codes"]
+
+    kentekens = columns["kenteken"].decode("ascii")
+    records = []
+    for i in range(count):
+        records.append(
+            KentekenRecord(
+                kentekens[i * 6 : i * 6 + 6],
+                columns["date"][i],
+                codes[columns["date_toelating"][i]],
+                columns["date_bpm"][i],
+                codes[columns["kleur"][i]],
+                columns["prijs"][i],
+                codes[columns["variant"][i]],
+                codes[columns["uitvoering"][i]],
+                codes[columns["typegoedkeuring"][i]],
+                codes[columns["label"][i]],
+                columns["flags"][i],
+            )
+        )
+    return records, header["counters"]
@@ -0,0 +1,255 @@
+"""rdw_history.py"""
+
+from datetime import datetime
+import hashlib
+from itertools import islice
+import json
+import os
+import sqlite3
+import sys
+import zlib
+from rdw_utils import arg_has, arg_value, iter_kentekens, my_die
+
+sys.stdout.flush()  # Disable output buffering
+
+# every fetched snapshot of x.kentekens, each distinct record stored once with
+# the spans of consecutive runs it was part of
+HISTORY_DB = "history.db"
+HISTORY_ZDICT_RECORDS = 40  # records of the first run that prime compression
+HISTORY_USAGE = (
+    "python rdw_history.py archive [file=x.kentekens]   add snapshot as a run\n"
+    "python rdw_history.py runs   archived runs\n"
+    "python rdw_history.py time=2025-03-01 [out=x.kentekens.20250301]"
+    "   fleet at that time\n"
+    "python rdw_history.py kenteken=GDR15F   versions of a kenteken and their runs"
+)
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    source TEXT NOT NULL,  -- size and mtime of the archived snapshot
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    digest BLOB NOT NULL UNIQUE,
+    kenteken TEXT NOT NULL,
+    data BLOB NOT NULL  -- json, zlib compressed with the zdict in meta
+);
+CREATE INDEX IF NOT EXISTS records_kenteken ON records (kenteken);
+CREATE TABLE IF NOT EXISTS spans (  -- record is in runs first_run..last_run
+    record INTEGER NOT NULL,
+    first_run INTEGER NOT NULL,
+    last_run INTEGER NOT NULL,
+    PRIMARY KEY (record, first_run)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS spans_last_run ON spans (last_run, first_run);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL);
+"""
+
+
+# ===============================================================================
+# open_history
+# parameter 1: database filename
+# ===============================================================================
+def open_history(filename: str = HISTORY_DB) -> sqlite3.Connection:
+    """open snapshot history database"""
+    connection = sqlite3.connect(filename)
+    connection.executescript(HISTORY_SCHEMA)
+    return connection
+
+
+# ===============================================================================
+# get_record_data
+# parameter 1: kenteken
+# ===============================================================================
+def get_record_data(hash_: dict) -> bytes:
+    """get kenteken as canonical json"""
+    return json.dumps(hash_, ensure_ascii=False, sort_keys=True).encode("utf8")
+
+
+# ===============================================================================
+# get_zdict
+# parameter 1: history database connection
+# parameter 2: snapshot filename, to make the zdict from when there is none
+# ===============================================================================
+def get_zdict(connection: sqlite3.Connection, filename: str = "") -> bytes:
+    """get preset dictionary of the compression, records look much alike"""
+    row = connection.execute("SELECT value FROM meta WHERE key = 'zdict'").fetchone()
+    if row is not None:
+        return row[0]
+    if filename == "":
+        return b""
+    kentekens = islice(iter_kentekens(filename), HISTORY_ZDICT_RECORDS)
+    zdict = b"".join(get_record_data(hash_) for hash_ in kentekens)
+    connection.execute("INSERT INTO meta VALUES ('zdict', ?)", (zdict,))
+    return zdict
+
+
+# ===============================================================================
+# compress_record
+# parameter 1: canonical json of kenteken
+# parameter 2: preset dictionary
+# ===============================================================================
+def compress_record(data: bytes, zdict: bytes) -> bytes:
+    """compress one record"""
+    compressor = zlib.compressobj(9, zdict=zdict)
+    return compressor.compress(data) + compressor.flush()
+
+
+# ===============================================================================
+# decompress_record
+# parameter 1: compressed record
+# parameter 2: preset dictionary
+# ===============================================================================
+def decompress_record(data: bytes, zdict: bytes) -> bytes:
+    """decompress one record"""
+    decompressor = zlib.decompressobj(zdict=zdict)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+# ===============================================================================
+# get_snapshot_source
+# parameter 1: snapshot filename
+# ===============================================================================
+def get_snapshot_source(filename: str) -> str:
+    """get size and mtime of snapshot, the same when it was not fetched again"""
+    stat = os.stat(filename)
+    return f"{stat.st_size} {stat.st_mtime_ns}"
+
+
+# ===============================================================================
+# archive_snapshot
+# parameter 1: history database connection
+# parameter 2: snapshot filename
+# ===============================================================================
+def archive_snapshot(connection: sqlite3.Connection, filename: str) -> int:
+    """add snapshot as a new run, storing only records not seen before"""
+    source = get_snapshot_source(filename)
+    last = connection.execute(
+        "SELECT run, source FROM runs ORDER BY run DESC LIMIT 1"
+    ).fetchone()
+    if last is not None and last[1] == source:
+        return 0  # not modified since the last run
+    previous = last[0] if last is not None else 0
+    run = previous + 1
+
+    # records of the previous run continue their span, others start a new one
+    query = "SELECT record, first_run FROM spans WHERE last_run = ?"
+    open_spans = dict(connection.execute(query, (previous,)))
+    continued = []
+    started = []
+    added = 0
+    count = 0
+    with connection:
+        zdict = get_zdict(connection, filename)
+        for hash_ in iter_kentekens(filename):
+            count += 1
+            data = get_record_data(hash_)
+            digest = hashlib.sha256(data).digest()
+            row = connection.execute(
+                "SELECT id FROM records WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is None:
+                record = connection.execute(
+                    "INSERT INTO records (digest, kenteken, data) VALUES (?, ?, ?)",
+                    (digest, hash_["kenteken"], compress_record(data, zdict)),
+                ).lastrowid
+                added += 1
+            else:
+                record = row[0]
+            if record in open_spans:
+                continued.append((run, record, open_spans.pop(record)))
+            else:
+                started.append((record, run, run))
+        connection.executemany(
+            "UPDATE spans SET last_run = ? WHERE record = ? AND first_run = ?",
+            continued,
+        )
+        connection.executemany("INSERT INTO spans VALUES (?, ?, ?)", started)
+        connection.execute(
+            "INSERT INTO runs VALUES (?, ?, ?, ?)",
+            (run, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), source, count),
+        )
+    print(f"INFO: Archived {count} kentekens as run {run}, {added} new records")
+    return run
+
+
+# ===============================================================================
+# get_run
+# parameter 1: history database connection
+# parameter 2: time yyyy-mm-dd[ hh:mm:ss]
+# ===============================================================================
+def get_run(connection: sqlite3.Connection, time: str) -> int:
+    """get the last run at or before time, 0 when none"""
+    row = connection.execute(
+        "SELECT max(run) FROM runs WHERE time <= ?", (time + "~",)
+    ).fetchone()
+    return row[0] or 0
+
+
+# ===============================================================================
+# iter_run
+# parameter 1: history database connection
+# parameter 2: run
+# ===============================================================================
+def iter_run(connection: sqlite3.Connection, run: int):
+    """yield the kentekens of a run, sorted on kenteken"""
+    zdict = get_zdict(connection)
+    query = "SELECT data FROM spans JOIN records ON id = record"
+    query += " WHERE last_run >= ? AND first_run <= ? ORDER BY kenteken"
+    for (data,) in connection.execute(query, (run, run)):
+        yield json.loads(decompress_record(data, zdict))
+
+
+# ===============================================================================
+# write_run
+# parameter 1: history database connection
+# parameter 2: run
+# parameter 3: snapshot filename, standard output when empty
+# ===============================================================================
+def write_run(connection: sqlite3.Connection, run: int, filename: str):
+    """write the kentekens of a run in the x.kentekens format"""
+    file = open(filename, "w", encoding="utf8") if filename else sys.stdout
+    file.write("[")
+    for i, hash_ in enumerate(iter_run(connection, run)):
+        if i > 0:
+            file.write(",")
+        json.dump(hash_, file, ensure_ascii=False)
+    file.write("]\n")
+    if filename:
+        file.close()
+
+
+def main():
+    """main"""
+    connection = open_history()
+    if arg_has("archive"):
+        if archive_snapshot(connection, arg_value("file") or "x.kentekens") == 0:
+            print("INFO: Snapshot not changed since the last run")
+    elif arg_has("runs"):
+        for row in connection.execute("SELECT run, time, count FROM runs"):
+            print(f"{row[0]:5d} {row[1]} {row[2]:6d} kentekens")
+    elif arg_value("time") != "":
+        run = get_run(connection, arg_value("time"))
+        if run == 0:
+            my_die(f"No run at or before {arg_value('time')}")
+        write_run(connection, run, arg_value("out"))
+    elif arg_value("kenteken") != "":
+        zdict = get_zdict(connection)
+        query = "SELECT first.time, last.time, data FROM records"
+        query += " JOIN spans ON id = record"
+        query += " JOIN runs first ON first.run = first_run"
+        query += " JOIN runs last ON last.run = last_run"
+        query += " WHERE kenteken = ? ORDER BY first_run"
+        for first, last, data in connection.execute(
+            query, (arg_value("kenteken").upper(),)
+        ):
+            print(f"{first} - {last}: {decompress_record(data, zdict).decode()}")
+    else:
+        print(HISTORY_USAGE)
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""rdw_index.py"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from rdw_utils import arg_value, my_die
+from rdw_state import STATE_INDEX, read_manifest
+
+sys.stdout.flush()  # Disable output buffering
+
+# sorted fixed-size records (kenteken, file, offset, length) of the lines of
+# state files, after a header with the files and their size and mtime
+INDEX_MAGIC = b"RDWI"
+INDEX_HEADER = struct.Struct("<4sII")  # magic, count, length of the file list
+INDEX_RECORD = struct.Struct("<6sHII")  # kenteken, file, offset, length
+INDEX_USAGE = "python rdw_index.py kenteken=GDR15F   line of kenteken in opnaam"
+
+
+# ===============================================================================
+# write_index
+# parameter 1: state files, every line starting with its kenteken
+# parameter 2: index filename
+# ===============================================================================
+def write_index(filenames: list, index_filename: str):
+    """write sorted kenteken index of state files"""
+    records = []
+    files = []
+    for number, filename in enumerate(filenames):
+        offset = 0
+        with open(filename, "rb") as file:
+            for line in file:
+                length = len(line.rstrip(b"\r\n"))
+                if length >= 6:
+                    records.append((line[0:6], number, offset, length))
+                offset += len(line)
+        stat = os.stat(filename)
+        files.append([filename, stat.st_size, stat.st_mtime_ns])
+    records.sort()
+    files = json.dumps(files).encode("utf8")
+    with open(index_filename + ".tmp", "wb") as file:
+        file.write(INDEX_HEADER.pack(INDEX_MAGIC, len(records), len(files)))
+        file.write(files)
+        for record in records:
+            file.write(INDEX_RECORD.pack(*record))
+    os.replace(index_filename + ".tmp", index_filename)
+
+
+# ===============================================================================
+# StateIndex
+# parameter 1: index filename
+# ===============================================================================
+class StateIndex:
+    """kenteken -> line of state files, by binary search in their mmap index"""
+
+    def __init__(self, index_filename: str):
+        self.index = None
+        self.filenames = []
+        self.lines = {}
+        self.count = 0
+        self.start = 0
+        if not os.path.isfile(index_filename):
+            return
+        with open(index_filename, "rb") as file:
+            index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(index) < INDEX_HEADER.size:
+            index.close()
+            return
+        magic, count, length = INDEX_HEADER.unpack_from(index)
+        start = INDEX_HEADER.size + length
+        if magic != INDEX_MAGIC or len(index) != start + count * INDEX_RECORD.size:
+            index.close()
+            return
+        files = json.loads(index[INDEX_HEADER.size : start])
+        for filename, size, mtime_ns in files:
+            stat = os.stat(filename) if os.path.isfile(filename) else None
+            if stat is None or (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                index.close()
+                return
+        self.index = index
+        self.filenames = [filename for filename, _, _ in files]
+        self.count = count
+        self.start = start
+
+    def is_valid(self) -> bool:
+        """index belongs to the current state files"""
+        return self.index is not None
+
+    def find(self, kenteken: str) -> int:
+        """get record position of kenteken, -1 when not found"""
+        if self.index is None or len(kenteken) != 6 or not kenteken.isascii():
+            return -1
+        key = kenteken.encode("ascii")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = self.start + middle * INDEX_RECORD.size
+            if self.index[position : position + 6] < key:
+                low = middle + 1
+            else:
+                high = middle
+        position = self.start + low * INDEX_RECORD.size
+        if low < self.count and self.index[position : position + 6] == key:
+            return position
+        return -1
+
+    def get(self, kenteken: str, default: str = None) -> str:
+        """get line of kenteken"""
+        position = self.find(kenteken)
+        if position < 0:
+            return default
+        _, number, offset, length = INDEX_RECORD.unpack_from(self.index, position)
+        if number not in self.lines:
+            with open(self.filenames[number], "rb") as file:
+                self.lines[number] = mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        return self.lines[number][offset : offset + length].decode("utf8")
+
+    def close(self):
+        """unmap index and state files, on Windows they can not be replaced before"""
+        for lines in self.lines.values():
+            lines.close()
+        self.lines = {}
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __contains__(self, kenteken: str) -> bool:
+        return self.find(kenteken) >= 0
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def main():
+    """main"""
+    kenteken = arg_value("kenteken")
+    if kenteken == "":
+        print(INDEX_USAGE)
+        return
+    filenames = [shard["file"] for shard in read_manifest()["shards"]]
+    with StateIndex(STATE_INDEX) as index:
+        current = index.is_valid() and index.filenames == filenames
+    if not current:
+        write_index(filenames, STATE_INDEX)
+    with StateIndex(STATE_INDEX) as index:
+        line = index.get(kenteken.upper())
+    if line is None:
+        my_die(f"{kenteken} not in {STATE_INDEX}")
+    print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""rdw_record.py"""
+
+import sys
+
+# flags of a kenteken record
+FLAG_NOG_NIET_OP_NAAM = 1
+FLAG_TAXI = 2
+FLAG_EXPORT = 4
+
+
+# ===============================================================================
+# KentekenRecord
+# parameter 1: kenteken
+# parameter 2: date op naam (or aanvraag kenteken when nog niet op naam) yyyymmdd
+# parameter 3: date eerste toelating yyyymmdd as given, can start with ??
+# parameter 4: date aanvraag kenteken yyyymmdd, 0 when none
+# parameter 5: kleur
+# parameter 6: catalogusprijs
+# parameter 7: variant, e.g. F5E32
+# parameter 8: uitvoering, e.g. E11A11
+# parameter 9: typegoedkeuring, e.g. e9*2018/858*11054*01
+# parameter 10: variant label of get_variant
+# parameter 11: flags
+# ===============================================================================
+class KentekenRecord:
+    """one classified kenteken, the fixed-width line is only made for output"""
+
+    __slots__ = (
+        "kenteken",
+        "date",
+        "date_toelating",
+        "date_bpm",
+        "kleur",
+        "prijs",
+        "variant",
+        "uitvoering",
+        "typegoedkeuring",
+        "label",
+        "flags",
+    )
+
+    def __init__(
+        self,
+        kenteken: str,
+        date: int,
+        date_toelating: str,
+        date_bpm: int,
+        kleur: str,
+        prijs: int,
+        variant: str,
+        uitvoering: str,
+        typegoedkeuring: str,
+        label: str = "",
+        flags: int = 0,
+    ):
+        self.kenteken = kenteken
+        self.date = date
+        self.date_toelating = date_toelating
+        self.date_bpm = date_bpm
+        self.kleur = sys.intern(kleur)
+        self.prijs = prijs
+        self.variant = sys.intern(variant)
+        self.uitvoering = sys.intern(uitvoering)
+        self.typegoedkeuring = sys.intern(typegoedkeuring)
+        self.label = sys.intern(label)
+        self.flags = flags
+
+    def get_cartype(self) -> str:
+        """get the variant part of the line, as given to get_variant"""
+        return (
+            f"{self.variant};{self.uitvoering};{self.typegoedkeuring};"
+            f" prijs: {self.prijs} {self.kleur:<10}{self.label}"
+        )
+
+    def get_special_line(self) -> str:
+        """get the fixed-width line with all fields, printed in debug mode"""
+        k = self.kenteken
+        return (
+            f"{k[0]}{k[4:6]}{k} {self.date} {self.kleur:<10} {self.prijs}    "
+            + self.get_cartype()
+            + self.get_suffix()
+        )
+
+    def get_suffix(self) -> str:
+        """get the import, aanvraag kenteken and nog niet op naam remarks"""
+        suffix = ""
+        if str(self.date) != self.date_toelating:
+            suffix += f" ({self.date_toelating} geimporteerd {self.date})"
+        elif self.date_bpm != 0:
+            suffix += f" (aanvraag kenteken {self.date_bpm})"
+        if self.flags & FLAG_NOG_NIET_OP_NAAM:
+            suffix += " (nog niet op naam)"
+        return suffix
+
+    def get_month(self) -> str:
+        """get year and month of date, yyyymm"""
+        return str(self.date // 100)
+
+
+# ===============================================================================
+# get_record_sort_key
+# parameter 1: kenteken record
+# ===============================================================================
+def get_record_sort_key(record: KentekenRecord) -> str:
+    """sort key as the start of the fixed-width line, kentekens are unique"""
+    k = record.kenteken
+    return f"{k[0]}{k[4:6]}{k}"
@@ -0,0 +1,355 @@
+"""rdw_server.py"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from rdw_utils import (
+    RDW_DATASET,
+    RDW_ENRICH_DATASETS,
+    arg_has,
+    arg_value,
+    iter_kentekens,
+    log,
+    my_die,
+)
+from rdw_state import STATE_MANIFEST, iter_state_file
+
+sys.stdout.flush()  # Disable output buffering
+
+# "python rdw_server.py port=8765 latency=0.2 errors=0.1 fixture=x.kentekens"
+# (fixture=x.IONIQ6.kentekens model=IONIQ6 for a recorded snapshot of another model)
+# and then "python rdw.py baseurl=http://127.0.0.1:8765"
+PORT = int(arg_value("port") or 8765)
+LATENCY = float(arg_value("latency") or 0)  # seconds per request
+ERRORS = float(arg_value("errors") or 0)  # fraction of requests failing with 503
+DATASETS = {}  # dataset -> rows
+VERSION = {"etag": "", "last_modified": ""}
+
+# synthetic variant for "<kWh> kWh[ AWD]" in a state file line
+SYNTHETIC_VARIANTS = {
+    "58 kWh": "F5E42",
+    "63 kWh": "F5E12",
+    "73 kWh": "F5E32",
+    "73 kWh AWD": "F5E14",
+    "77 kWh": "F5E62",
+    "77 kWh AWD": "F5E54",
+    "84 kWh": "F5E34",
+    "84 kWh AWD": "F5E74",
+}
+SYNTHETIC_KLEUREN = {
+    "Gravity Gold": "GEEL",
+    "Phantom Black": "ZWART",
+    "Red Metallic": "ROOD",
+    "Mystic Olive": "GROEN",
+    "Digital Teal": "GROEN",
+    "Lucid Blue": "BLAUW",
+    "Shooting Star": "GRIJS",
+    "Cyber/Galactic": "GRIJS",
+    "White Matte": "WIT",
+    "Atlas White": "WIT",
+}
+SYNTHETIC_VERMOGENS = {
+    "F5E42": "125.00",
+    "F5E12": "160.00",
+    "F5E32": "160.00",
+    "F5E14": "239.00",
+    "F5E62": "168.00",
+    "F5E54": "239.00",
+    "F5E34": "168.00",
+    "F5E74": "239.00",
+}
+SYNTHETIC_LINE = re.compile(r"(\S{6}) (\d{8}) E(\d+) (.{14}) (\d\d kWh(?: AWD)?)(.*)$")
+
+
+# ===============================================================================
+# get_synthetic_kenteken
+# parameter 1: line of opnaam, nognietopnaam.txt or exported.txt
+# parameter 2: line is from nognietopnaam.txt
+# ===============================================================================
+def get_synthetic_kenteken(line: str, nog_niet_op_naam: bool) -> dict:
+    """get RDW like kenteken from state file line, None when not parsable"""
+    match = SYNTHETIC_LINE.match(line)
+    if not match:
+        return None
+    kenteken, date, prijs, kleur, kwh, rest = match.groups()
+    variant = SYNTHETIC_VARIANTS[kwh]
+    typegoedkeuring = "e9*2018/858*11054*05"
+    for model, nummer in (("2022)", "01"), ("2022.5)", "03"), ("2023)", "04")):
+        if f"(model {model}" in rest:
+            typegoedkeuring = f"e9*2018/858*11054*{nummer}"
+    inch20 = "(20 inch banden)" in rest or (
+        ("Lounge" in rest or "PROJECT45" in rest) and "(19 inch banden)" not in rest
+    )
+    hash_ = {
+        "kenteken": kenteken,
+        "voertuigsoort": "Personenauto",
+        "merk": "HYUNDAI",
+        "handelsbenaming": "IONIQ5",
+        "eerste_kleur": SYNTHETIC_KLEUREN.get(kleur.strip(), kleur.strip()),
+        "catalogusprijs": prijs,
+        "variant": variant,
+        "uitvoering": "E11B11" if inch20 else "E11A11",
+        "typegoedkeuringsnummer": typegoedkeuring,
+        "taxi_indicator": "Ja" if "(Taxi)" in rest else "Nee",
+        "export_indicator": "Ja" if "(geexporteerd)" in rest else "Nee",
+    }
+    geimporteerd = re.search(r"\((\d{8}) geimporteerd \d{8}\)", rest)
+    aanvraag = re.search(r"\(aanvraag kenteken (\d{8})\)", rest)
+    date_bpm = date if nog_niet_op_naam else aanvraag and aanvraag.group(1)
+    if date_bpm:
+        hash_["registratie_datum_goedkeuring_afschrijvingsmoment_bpm_dt"] = (
+            f"{date_bpm[:4]}-{date_bpm[4:6]}-{date_bpm[6:]}T00:00:00.000"
+        )
+    if not nog_niet_op_naam:
+        hash_["datum_eerste_tenaamstelling_in_nederland"] = date
+    if geimporteerd:
+        hash_["datum_eerste_toelating"] = geimporteerd.group(1)
+    elif not nog_niet_op_naam:
+        hash_["datum_eerste_toelating"] = date
+    return hash_
+
+
+# ===============================================================================
+# get_synthetic_kentekens
+# ===============================================================================
+def get_synthetic_kentekens() -> list:
+    """get synthetic kentekens from the state files in the current directory"""
+    kentekens = {}
+    for filename, nog_niet_op_naam in (
+        (STATE_MANIFEST, False),
+        ("nognietopnaam.txt", True),
+        ("exported.txt", False),
+    ):
+        for line in iter_state_file(filename):
+            hash_ = get_synthetic_kenteken(line, nog_niet_op_naam)
+            if hash_ and hash_["kenteken"] not in kentekens:
+                kentekens[hash_["kenteken"]] = hash_
+    return list(kentekens.values())
+
+
+# ===============================================================================
+# load_datasets
+# parameter 1: recorded kentekens json (x.kentekens), synthetic when empty
+# ===============================================================================
+def load_datasets(fixture: str):
+    """load kentekens fixture and derive the companion datasets from it"""
+    if fixture != "":
+        if not os.path.isfile(fixture):
+            my_die(f"Fixture not found: {fixture}")
+        kentekens = list(iter_kentekens(fixture))
+        modified = os.path.getmtime(fixture)
+    else:
+        kentekens = get_synthetic_kentekens()
+        modified = time.time()
+
+    # recorded snapshots only have the fields rdw.py uses, not these
+    model = arg_value("model") or "IONIQ5"
+    for index, hash_ in enumerate(kentekens):
+        hash_.setdefault("handelsbenaming", model)
+        hash_.setdefault(":id", f"row-{index:08x}")
+        hash_.setdefault(
+            ":updated_at",
+            time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(modified)),
+        )
+    DATASETS[RDW_DATASET] = kentekens
+    brandstof, carrosserie = RDW_ENRICH_DATASETS
+    DATASETS[brandstof] = [
+        {
+            "kenteken": hash_["kenteken"],
+            "brandstof_omschrijving": "Elektriciteit",
+            "nettomaximumvermogen": SYNTHETIC_VERMOGENS.get(hash_.get("variant"), ""),
+            ":id": hash_[":id"],
+        }
+        for hash_ in kentekens
+    ]
+    DATASETS[carrosserie] = [
+        {
+            "kenteken": hash_["kenteken"],
+            "carrosserietype": "AB",
+            "type_carrosserie_europese_omschrijving": "Hatchback",
+            ":id": hash_[":id"],
+        }
+        for hash_ in kentekens
+    ]
+    VERSION["etag"] = f"{len(kentekens)}-{modified}"
+    VERSION["last_modified"] = time.strftime(
+        "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(modified)
+    )
+
+
+# ===============================================================================
+# get_where_filter
+# parameter 1: Socrata $where, for example (`handelsbenaming` = 'IONIQ5')
+# ===============================================================================
+def get_where_filter(where: str):
+    """get row filter for the $where subset the rdw scripts use"""
+    where = where.strip()
+    while where.startswith("(") and where.endswith(")"):
+        where = where[1:-1].strip()
+    parts = re.split(r"\s+AND\s+", where, flags=re.IGNORECASE)
+    if len(parts) > 1:
+        filters = [get_where_filter(part) for part in parts]
+        return lambda row: all(filter_(row) for filter_ in filters)
+    match = re.match(r"`?([:\w]+)`?\s+IN\s*\((.*)\)$", where, re.IGNORECASE)
+    if match:
+        field = match.group(1)
+        values = set(re.findall(r"'([^']*)'", match.group(2)))
+        return lambda row: row.get(field, "") in values
+    match = re.match(r"`?([:\w]+)`?\s*(=|>=|<=|>|<)\s*'((?:[^']|'')*)'$", where)
+    if not match:
+        raise ValueError(f"Unsupported $where: {where}")
+    field, operator, value = match.groups()
+    value = value.replace("''", "'")
+    compare = {
+        "=": lambda a, b: a == b,
+        ">=": lambda a, b: a >= b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        "<": lambda a, b: a < b,
+    }[operator]
+    return lambda row: compare(row.get(field, ""), value)
+
+
+# ===============================================================================
+# query_dataset
+# parameter 1: dataset rows
+# parameter 2: Socrata $-parameters
+# ===============================================================================
+def query_dataset(rows: list, params: dict) -> list:
+    """apply $where, $order, $offset, $limit and $select to rows"""
+    if "$where" in params:
+        rows = list(filter(get_where_filter(params["$where"]), rows))
+    select = params.get("$select", "*")
+    if select.lower().startswith("count(*)"):
+        return [{"count": str(len(rows))}]
+
+    match = re.match(r"`?([:\w]+)`?\s*(ASC|DESC)?", params.get("$order", ":id"))
+    rows = sorted(
+        rows,
+        key=lambda row: row.get(match.group(1), ""),
+        reverse=(match.group(2) or "").upper() == "DESC",
+    )
+    offset = int(params.get("$offset", 0))
+    rows = rows[offset : offset + int(params.get("$limit", 1000))]
+
+    fields = [field.strip().strip("`") for field in select.split(",")]
+    result = []
+    for row in rows:
+        hash_ = {}
+        for field in fields:
+            if field == "*":
+                hash_.update({k: v for k, v in row.items() if k[0] != ":"})
+            elif field == ":*":
+                hash_.update({k: v for k, v in row.items() if k[0] == ":"})
+            elif field in row:
+                hash_[field] = row[field]
+        result.append(hash_)
+    return result
+
+
+# ===============================================================================
+# get_csv
+# parameter 1: rows from query_dataset
+# ===============================================================================
+def get_csv(rows: list) -> str:
+    """get rows as Socrata csv, header line with the field names"""
+    fields = []
+    for row in rows:
+        fields.extend(field for field in row if field not in fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([row.get(field, "") for field in fields])
+    return buffer.getvalue()
+
+
+class RdwHandler(BaseHTTPRequestHandler):
+    """Socrata /api/id/<dataset>.json endpoint"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if arg_has("debug"):
+            log(format % args)
+
+    def send_empty(self, status: int, etag: str = ""):
+        """send response without body"""
+        self.send_response(status)
+        if etag != "":
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """answer a Socrata query"""
+        if LATENCY > 0:
+            time.sleep(LATENCY)
+        if ERRORS > 0 and random.random() < ERRORS:
+            self.send_empty(503)
+            return
+        url = urlsplit(self.path)
+        match = re.match(r"/api/id/([\w-]+)\.(json|csv)$", url.path)
+        if not match or match.group(1) not in DATASETS:
+            self.send_empty(404)
+            return
+
+        # the ETag changes with the data and the query, like Socrata
+        etag = hashlib.md5((VERSION["etag"] + url.query).encode()).hexdigest()
+        etag = f'"{etag}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_empty(304, etag)
+            return
+        try:
+            rows = query_dataset(DATASETS[match.group(1)], dict(parse_qsl(url.query)))
+        except ValueError as error:
+            body = json.dumps({"error": True, "message": str(error)}).encode()
+            self.send_response(400)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if match.group(2) == "csv":
+            body = get_csv(rows).encode()
+            content_type = "text/csv;charset=utf-8"
+        else:
+            body = json.dumps(rows).encode()
+            content_type = "application/json;charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", VERSION["last_modified"])
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    """main"""
+    load_datasets(arg_value("fixture"))
+    log(
+        f"Serving {len(DATASETS[RDW_DATASET])} kentekens on http://127.0.0.1:{PORT}"
+        f" (latency {LATENCY}s, errors {ERRORS})"
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", PORT), RdwHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""rdw_state.py"""
+
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+from rdw_utils import arg_has, arg_value, my_die
+
+sys.stdout.flush()  # Disable output buffering
+
+# state of every kenteken in one SQLite database, exported.txt,
+# nognietopnaam.txt and the opnaam shards are export views of it
+STATE_DB = "rdw.db"
+STATE_SHARDS = "opnaam"  # opnaam/202502.txt etc., a file per month
+STATE_MANIFEST = os.path.join(STATE_SHARDS, "manifest.json")
+STATE_INDEX = os.path.join(STATE_SHARDS, "index.idx")
+STATE_LEGACY = "opnaam.txt"  # opnaam in one file, before the shards
+STATE_VIEWS = {
+    "exported.txt": "exported",
+    "nognietopnaam.txt": "nognietopnaam",
+    STATE_MANIFEST: "opnaam",
+}
+NOG_NIET_OP_NAAM = " (nog niet op naam)"
+STATE_JOURNAL_DAYS = 365  # older journal entries are compacted into checkpoint
+STATE_EMPTY = (None, None, None)  # status, line, exported_line
+STATE_USAGE = """python rdw_state.py journal [kenteken=K123AB]   journal of kentekens
+python rdw_state.py replay=2025-01-01 [view=opnaam]   state file at that time
+python rdw_state.py verify   replayed journal is the same as the kentekens table
+python rdw_state.py compact [days=365]   fold older journal into the checkpoint"""
+STATE_LINE = re.compile(r"(\S{6}) (\d{8}) E\d+ +(.{14}) (.*?)(?= \(|$)")
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kentekens (
+    kenteken TEXT PRIMARY KEY,
+    status TEXT,  -- opnaam, nognietopnaam or NULL when no longer at RDW
+    datum TEXT NOT NULL,
+    kleur TEXT NOT NULL,
+    variant TEXT NOT NULL,  -- variant label of the print line, e.g. 73 kWh Lounge
+    line TEXT,  -- print line of the last run, NULL when status is NULL
+    exported_line TEXT  -- print line in exported.txt, NULL when not exported
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kentekens_status ON kentekens (status);
+CREATE INDEX IF NOT EXISTS kentekens_datum ON kentekens (datum);
+CREATE INDEX IF NOT EXISTS kentekens_kleur ON kentekens (kleur, variant);
+CREATE TABLE IF NOT EXISTS journal (  -- append-only, every change of a kenteken
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time TEXT NOT NULL,
+    kenteken TEXT NOT NULL,
+    transition TEXT NOT NULL,
+    status TEXT,
+    line TEXT,
+    exported_line TEXT
+);
+CREATE INDEX IF NOT EXISTS journal_kenteken ON journal (kenteken);
+CREATE INDEX IF NOT EXISTS journal_time ON journal (time);
+CREATE TABLE IF NOT EXISTS checkpoint (  -- state before the oldest journal entry
+    kenteken TEXT PRIMARY KEY,
+    status TEXT,
+    line TEXT,
+    exported_line TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+# ===============================================================================
+# get_state_sort_key
+# parameter 1: print line
+# ===============================================================================
+def get_state_sort_key(line: str) -> tuple:
+    """sort key of the state files: date, kenteken letters"""
+    return (line[7:], line[0:1], line[4:6], line[1:])
+
+
+# ===============================================================================
+# get_state_columns
+# parameter 1: print line
+# ===============================================================================
+def get_state_columns(line: str) -> tuple:
+    """get datum, kleur and variant label of a print line"""
+    match = STATE_LINE.match(line)
+    if not match:
+        return line[7:15], "", ""
+    return match.group(2), match.group(3).rstrip(), match.group(4)
+
+
+# ===============================================================================
+# get_shard_filename
+# parameter 1: print line
+# ===============================================================================
+def get_shard_filename(line: str) -> str:
+    """get opnaam shard of a print line: its year and month"""
+    return os.path.join(STATE_SHARDS, f"{line[7:13]}.txt")
+
+
+# ===============================================================================
+# read_manifest
+# ===============================================================================
+def read_manifest() -> dict:
+    """read the list of opnaam shards, newest first"""
+    if not os.path.isfile(STATE_MANIFEST):
+        return {"shards": []}
+    with open(STATE_MANIFEST, "r", encoding="utf8") as file:
+        return json.load(file)
+
+
+# ===============================================================================
+# iter_state_file
+# parameter 1: state file, for opnaam its manifest
+# ===============================================================================
+def iter_state_file(filename: str):
+    """yield the lines of a state file, of all shards for opnaam"""
+    if filename == STATE_MANIFEST:
+        if os.path.isfile(STATE_MANIFEST):
+            for shard in read_manifest()["shards"]:
+                yield from iter_state_file(shard["file"])
+            return
+        filename = STATE_LEGACY
+    if not os.path.isfile(filename):
+        return
+    with open(filename, "r", encoding="utf8") as file:
+        for line in file:
+            yield line.rstrip("\n")
+
+
+# ===============================================================================
+# open_state
+# parameter 1: database filename
+# ===============================================================================
+def open_state(filename: str = STATE_DB) -> sqlite3.Connection:
+    """open state database, importing the state files when it is new"""
+    connection = sqlite3.connect(filename)
+    connection.executescript(STATE_SCHEMA)
+    if connection.execute("SELECT 1 FROM kentekens LIMIT 1").fetchone() is None:
+        import_state(connection)
+    return connection
+
+
+# ===============================================================================
+# import_state
+# parameter 1: state database connection
+# ===============================================================================
+def import_state(connection: sqlite3.Connection):
+    """import opnaam, nognietopnaam.txt and exported.txt"""
+    rows = {}
+    for filename, view in STATE_VIEWS.items():
+        for line in iter_state_file(filename):
+            k = line[:6]
+            if k == "":
+                continue
+            row = rows.setdefault(k, [None, None, None])
+            if view == "exported":
+                row[2] = line
+            else:
+                row[0] = view
+                row[1] = line + (NOG_NIET_OP_NAAM if view == "nognietopnaam" else "")
+    if len(rows) > 0:
+        write_rows(connection, rows, {}, "gekend")
+        print(f"INFO: Imported {len(rows)} kentekens into {STATE_DB}")
+
+
+# ===============================================================================
+# read_state
+# parameter 1: state database connection
+# parameter 2: opnaam, nognietopnaam or exported
+# ===============================================================================
+def read_state(connection: sqlite3.Connection, view: str) -> dict:
+    """get kenteken -> print line of a view"""
+    if view == "exported":
+        query = "SELECT kenteken, exported_line FROM kentekens"
+        query += " WHERE exported_line IS NOT NULL"
+        return dict(connection.execute(query))
+    query = "SELECT kenteken, line FROM kentekens WHERE status = ?"
+    return dict(connection.execute(query, (view,)))
+
+
+# ===============================================================================
+# get_transition
+# parameter 1: previous (status, line, exported_line)
+# parameter 2: new (status, line, exported_line)
+# ===============================================================================
+def get_transition(old: tuple, row: tuple) -> str:
+    """describe the change of a kenteken for the journal"""
+    if old[0] != row[0]:
+        return {
+            (None, "nognietopnaam"): "nieuw nog niet op naam",
+            (None, "opnaam"): "nieuw op naam",
+            ("nognietopnaam", "opnaam"): "op naam gezet",
+            ("opnaam", "nognietopnaam"): "terug naar nog niet op naam",
+        }.get((old[0], row[0]), "niet meer bij RDW")
+    if old[2] is None and row[2] is not None:
+        return "geexporteerd"
+    return "gewijzigd"
+
+
+# ===============================================================================
+# write_rows
+# parameter 1: state database connection
+# parameter 2: new rows kenteken -> [status, line, exported_line]
+# parameter 3: current rows kenteken -> (status, line, exported_line)
+# ===============================================================================
+def write_rows(
+    connection: sqlite3.Connection, rows: dict, current: dict, transition: str = ""
+) -> set:
+    """upsert changed rows and journal them in one transaction, changed views"""
+    changed = set()
+    upserts = []
+    deletes = []
+    journal = []
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for k, row in rows.items():
+        row = tuple(row)
+        old = current.get(k, STATE_EMPTY)
+        if row == old:
+            continue
+        changed.update(status for status in (row[0], old[0]) if status)
+        if row[2] != old[2]:
+            changed.add("exported")
+        upserts.append((k, *get_state_columns(row[1] or row[2]), *row))
+        journal.append((now, k, transition or get_transition(old, row), *row))
+    for k, old in current.items():
+        if k not in rows:
+            deletes.append((k,))
+            changed.update(
+                status for status in (old[0], old[2] and "exported") if status
+            )
+            journal.append((now, k, "verwijderd", *STATE_EMPTY))
+
+    with connection:  # one transaction, rolled back on errors
+        connection.executemany(
+            "INSERT INTO journal"
+            " (time, kenteken, transition, status, line, exported_line)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            journal,
+        )
+        connection.executemany(
+            "INSERT INTO kentekens"
+            " (kenteken, datum, kleur, variant, status, line, exported_line)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (kenteken) DO UPDATE SET"
+            " datum = excluded.datum, kleur = excluded.kleur,"
+            " variant = excluded.variant, status = excluded.status,"
+            " line = excluded.line, exported_line = excluded.exported_line",
+            upserts,
+        )
+        connection.executemany("DELETE FROM kentekens WHERE kenteken = ?", deletes)
+    return changed
+
+
+# ===============================================================================
+# write_state
+# parameter 1: state database connection
+# parameter 2: opnaam print lines of this run
+# parameter 3: nognietopnaam print lines of this run
+# parameter 4: exported kenteken -> print line
+# ===============================================================================
+def write_state(
+    connection: sqlite3.Connection, opnaam: list, nognietopnaam: list, exported: dict
+) -> set:
+    """store the state of this run, only changed rows are written"""
+    rows = {}
+    for view, lines in (("opnaam", opnaam), ("nognietopnaam", nognietopnaam)):
+        for line in lines:
+            rows[line[:6]] = [view, line, None]
+    for k, line in exported.items():
+        rows.setdefault(k, [None, None, None])[2] = line
+    query = "SELECT kenteken, status, line, exported_line FROM kentekens"
+    current = {row[0]: row[1:] for row in connection.execute(query)}
+    changed = write_rows(connection, rows, current)
+    compact_state(connection, STATE_JOURNAL_DAYS)
+    return changed
+
+
+# ===============================================================================
+# get_state_view
+# parameter 1: state database connection
+# parameter 2: opnaam, nognietopnaam or exported
+# ===============================================================================
+def get_state_view(connection: sqlite3.Connection, view: str) -> list:
+    """get the lines of a state file, sorted like before"""
+    lines = sorted(
+        read_state(connection, view).values(), key=get_state_sort_key, reverse=True
+    )
+    if view == "nognietopnaam":
+        lines = [line.replace(NOG_NIET_OP_NAAM, "") for line in lines]
+    return lines
+
+
+# ===============================================================================
+# get_state_files
+# parameter 1: state database connection
+# ===============================================================================
+def get_state_files(connection: sqlite3.Connection) -> dict:
+    """get filename -> lines of every state file, opnaam as shards and manifest"""
+    files = {}
+    for filename, view in STATE_VIEWS.items():
+        lines = get_state_view(connection, view)
+        if filename != STATE_MANIFEST:
+            files[filename] = lines
+            continue
+        shards = {}
+        for line in lines:
+            shards.setdefault(get_shard_filename(line), []).append(line)
+        manifest = []
+        for shard, shard_lines in shards.items():
+            content = "".join(f"{line}\n" for line in shard_lines)
+            digest = hashlib.sha256(content.encode("utf8")).hexdigest()
+            manifest.append(
+                {"file": shard, "lines": len(shard_lines), "sha256": digest}
+            )
+        files.update(shards)
+        files[filename] = json.dumps({"shards": manifest}, indent=1).splitlines()
+    return files
+
+
+# ===============================================================================
+# replay_state
+# parameter 1: state database connection
+# parameter 2: time yyyy-mm-dd[ hh:mm:ss], state before this time, now when empty
+# ===============================================================================
+def replay_state(connection: sqlite3.Connection, until: str = "") -> dict:
+    """get kenteken -> (status, line, exported_line) by replaying the journal"""
+    compacted = get_meta(connection, "checkpoint_time")
+    if until != "" and until < compacted:
+        my_die(f"Journal before {compacted} is compacted, cannot replay {until}")
+    query = "SELECT kenteken, status, line, exported_line FROM checkpoint"
+    rows = {row[0]: row[1:] for row in connection.execute(query)}
+    query = "SELECT kenteken, status, line, exported_line FROM journal"
+    query += " WHERE time < ? ORDER BY id"
+    for row in connection.execute(query, (until or "9999",)):
+        if row[1:] == STATE_EMPTY:
+            rows.pop(row[0], None)
+        else:
+            rows[row[0]] = row[1:]
+    return rows
+
+
+# ===============================================================================
+# compact_state
+# parameter 1: state database connection
+# parameter 2: journal entries older than days are folded into the checkpoint
+# ===============================================================================
+def compact_state(connection: sqlite3.Connection, days: int):
+    """fold old journal entries into the checkpoint table"""
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    query = "SELECT max(id) FROM journal WHERE time < ?"
+    last_id = connection.execute(query, (cutoff,)).fetchone()[0]
+    if last_id is None:
+        return
+    query = "SELECT kenteken, status, line, exported_line FROM journal"
+    query += " WHERE id <= ? ORDER BY id"
+    entries = connection.execute(query, (last_id,)).fetchall()
+    with connection:  # one transaction, rolled back on errors
+        for k, *row in entries:
+            if tuple(row) == STATE_EMPTY:
+                connection.execute("DELETE FROM checkpoint WHERE kenteken = ?", (k,))
+            else:
+                connection.execute(
+                    "INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?)", (k, *row)
+                )
+        connection.execute("DELETE FROM journal WHERE id <= ?", (last_id,))
+        connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('checkpoint_time', ?)", (cutoff,)
+        )
+    print(f"INFO: Compacted {len(entries)} journal entries before {cutoff}")
+
+
+# ===============================================================================
+# get_meta
+# parameter 1: state database connection
+# parameter 2: key
+# ===============================================================================
+def get_meta(connection: sqlite3.Connection, key: str) -> str:
+    """get meta value, empty when not set"""
+    row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else ""
+
+
+# ===============================================================================
+# set_meta
+# parameter 1: state database connection
+# parameter 2: key
+# parameter 3: value
+# ===============================================================================
+def set_meta(connection: sqlite3.Connection, key: str, value: str):
+    """set meta value"""
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+
+def main():
+    """main"""
+    connection = open_state()
+    if arg_has("journal"):
+        query = "SELECT time, kenteken, transition, coalesce(line, exported_line, '')"
+        query += " FROM journal WHERE kenteken LIKE ? ORDER BY id"
+        for row in connection.execute(query, (arg_value("kenteken") or "%",)):
+            print(" ".join(row))
+    elif arg_value("replay") != "":
+        view = arg_value("view") or "opnaam"
+        rows = replay_state(connection, arg_value("replay"))
+        if view == "exported":
+            lines = [row[2] for row in rows.values() if row[2] is not None]
+        else:
+            lines = [row[1] for row in rows.values() if row[0] == view]
+        for line in sorted(lines, key=get_state_sort_key, reverse=True):
+            print(line.replace(NOG_NIET_OP_NAAM, ""))
+    elif arg_has("verify"):
+        query = "SELECT kenteken, status, line, exported_line FROM kentekens"
+        current = {row[0]: row[1:] for row in connection.execute(query)}
+        if replay_state(connection) != current:
+            my_die("Replayed journal differs from kentekens")
+        print(f"OK: journal replays to {len(current)} kentekens")
+    elif arg_has("compact"):
+        compact_state(connection, int(arg_value("days") or STATE_JOURNAL_DAYS))
+    else:
+        print(STATE_USAGE)
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
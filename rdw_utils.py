@@ -1,14 +1,26 @@
 """rdw_utils.py"""
 
 # pylint:disable=too-many-lines
+import asyncio
+import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import csv
 from datetime import datetime
+import gzip
+import http.client
+import io
+from itertools import islice
+import json
+import os
+import random
 import re
-import socket
 import sys
+import threading
 import time
 import traceback
-from urllib import request
-from urllib.error import HTTPError, URLError
+from urllib.parse import quote, unquote, urlencode, urljoin, urlsplit
+import urllib.request
 
 
 # == log ========================================================================
@@ -32,29 +44,610 @@ def my_die(txt):
     sys.exit(1)
 
 
-# == get_kentekens ====================================================================
-def get_kentekens():
-    """get_kentekens and handle errors"""
+# == RDW Socrata API ============================================================
+RDW_BASE_URL = "https://opendata.rdw.nl"
+RDW_DATASET = "m9d7-ebf2"  # gekentekende voertuigen
+RDW_WHERE = "(`handelsbenaming` = 'IONIQ5')"
+RDW_PAGE_SIZE = 8000  # rows per request
+RDW_MAX_WORKERS = 4  # concurrent page requests
+RDW_MAX_MODELS = 3  # concurrent models
+RDW_RETRY_DELAY = 2  # seconds before first retry, doubled every retry
+RDW_RETRY_MAX_DELAY = 60  # maximum seconds between retries
+RDW_DEADLINE = 30 * 60  # maximum seconds for getting all kentekens
+RDW_TIMEOUT = 60  # seconds before a connect or read times out
+RDW_MAX_CONNECTIONS = 8  # keep-alive connections per host
+CHECKPOINT_LOCK = threading.Lock()
+HTTP_LOCK = threading.Lock()
+HTTP_IDLE = {}  # (scheme, host) -> idle keep-alive connections
+HTTP_SLOTS = {}  # (scheme, host) -> semaphore limiting connections per host
+RDW_ENRICH_BATCH_SIZE = 200  # kentekens per IN (...) request
+RDW_ENRICH_DATASETS = {
+    "8ys7-d773": [  # brandstof
+        "kenteken",
+        "brandstof_omschrijving",
+        "nettomaximumvermogen",
+        "actie_radius_enkel_elektrisch_wltp",
+        "elektrisch_verbruik_enkel_elektrisch_wltp",
+    ],
+    "vezc-m2t6": [  # carrosserie
+        "kenteken",
+        "carrosserietype",
+        "type_carrosserie_europese_omschrijving",
+    ],
+}
+JSON_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def get_rdw_url(dataset: str, params: dict, fmt: str = "json") -> str:
+    """get Socrata url for dataset with $-parameters, json or csv"""
+    query = urlencode(
+        {**params, "$$read_from_nbe": "true", "$$version": "2.1"},
+        quote_via=quote,
+        safe="$*`:",
+    )
+    base_url = arg_value("baseurl") or RDW_BASE_URL  # e.g. rdw_server.py
+    return f"{base_url.rstrip('/')}/api/id/{dataset}.{fmt}?{query}"
+
+
+# == http session ===============================================================
+def get_http_connection(key: tuple, reuse: bool = True) -> tuple:
+    """get idle keep-alive connection for (scheme, host) or a new one, reused"""
+    with HTTP_LOCK:
+        if reuse and len(HTTP_IDLE.get(key, [])) > 0:
+            return HTTP_IDLE[key].pop(), True
+    scheme, host = key
+    proxy = get_proxy(scheme, host)
+    if proxy is None:
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, timeout=RDW_TIMEOUT), False
+        return http.client.HTTPConnection(host, timeout=RDW_TIMEOUT), False
+    address = proxy.netloc.rpartition("@")[2]
+    if scheme == "https":  # tunnel with CONNECT, TLS is end to end
+        connection = http.client.HTTPSConnection(address, timeout=RDW_TIMEOUT)
+        connection.set_tunnel(host, headers=get_proxy_headers(proxy))
+        return connection, False
+    return http.client.HTTPConnection(address, timeout=RDW_TIMEOUT), False
+
+
+def get_proxy(scheme: str, host: str):
+    """get proxy url for scheme and host from HTTPS_PROXY/HTTP_PROXY/NO_PROXY
+    as urlopen uses them, None when host is not proxied"""
+    proxy = urllib.request.getproxies().get(scheme)
+    if proxy is None or urllib.request.proxy_bypass(host):
+        return None
+    return urlsplit(proxy if "://" in proxy else "http://" + proxy)
+
+
+def get_proxy_headers(proxy) -> dict:
+    """get Proxy-Authorization for the user and password in the proxy url"""
+    if proxy.username is None:
+        return {}
+    credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}"
+    token = base64.b64encode(credentials.encode("utf8")).decode("ascii")
+    return {"Proxy-Authorization": f"Basic {token}"}
+
+
+def get_response_stream(response):
+    """get body of response as a stream, decompressed while it is read"""
+    if response.headers.get("Content-Encoding") == "gzip":
+        return gzip.GzipFile(fileobj=response)
+    return response
+
+
+def http_get(url: str, headers: dict, parse=None) -> tuple:
+    """GET url over a pooled keep-alive connection: status, reason, headers, body,
+    the body of a 200 response parsed from its stream when parse is given"""
+    for _ in range(5):  # follow redirects
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        request_headers = headers
+        proxy = get_proxy(parts.scheme, parts.netloc)
+        if proxy is not None and parts.scheme == "http":
+            path = url.split("#")[0]  # a proxy gets the absolute url
+            request_headers = {**headers, **get_proxy_headers(proxy)}
+        with HTTP_LOCK:
+            slots = HTTP_SLOTS.setdefault(
+                key, threading.BoundedSemaphore(RDW_MAX_CONNECTIONS)
+            )
+        with slots:
+            while True:
+                connection, reused = get_http_connection(key)
+                try:
+                    connection.request("GET", path, headers=request_headers)
+                    response = connection.getresponse()
+                    if parse is None or response.status != 200:
+                        body = response.read()
+                    else:
+                        body = parse(get_response_stream(response))
+                        response.read()  # end of the body, to reuse the connection
+                    break
+                except ConnectionError:
+                    connection.close()
+                    if not reused:
+                        raise
+                    # idle connection closed by the server, try the next one
+                except Exception:
+                    connection.close()
+                    raise
+            if response.will_close:
+                connection.close()
+            else:
+                with HTTP_LOCK:
+                    HTTP_IDLE.setdefault(key, []).append(connection)
+        location = response.headers.get("Location")
+        if response.status not in (301, 302, 303, 307, 308) or not location:
+            break
+        url = urljoin(url, location)
+    return response.status, response.reason, response.headers, body
+
+
+# == get_url_json ===============================================================
+def get_url_json(url: str, deadline: float, headers=None, response_headers=None):
+    """get json from url and handle errors, None when not modified (304)"""
+    return get_url(url, deadline, json.load, headers, response_headers)
+
+
+def get_url_csv(url: str, deadline: float) -> list:
+    """get csv rows from url as dicts like the json api and handle errors"""
+    return get_url(url, deadline, parse_csv)
+
+
+def get_url_rows(url: str, deadline: float) -> list:
+    """get json array of rows from url, parsed row by row and handle errors"""
+    return get_url(url, deadline, parse_json_rows)
+
+
+def parse_json_rows(stream) -> list:
+    """parse json array of rows from the stream, one row at a time"""
+    text = io.TextIOWrapper(stream, encoding="utf8")
+    rows = list(iter_json_array(text))
+    text.detach()  # the response is not closed with the wrapper
+    return rows
+
+
+def parse_csv(stream) -> list:
+    """parse Socrata csv with header line, leaving out empty fields like json"""
+    text = io.TextIOWrapper(stream, encoding="utf8", newline="")
+    reader = csv.reader(text)
+    fields = next(reader, [])
+    rows = [
+        {field: value for field, value in zip(fields, row) if value != ""}
+        for row in reader
+    ]
+    text.detach()  # the response is not closed with the wrapper
+    return rows
+
+
+def get_url(url: str, deadline: float, parse, headers=None, response_headers=None):
+    """get url, parse the body stream and handle errors, None when not modified"""
+    retry = 0
+    headers = {**(headers or {}), "Accept-Encoding": "gzip"}
     while True:
-        url = "https://opendata.rdw.nl/api/id/m9d7-ebf2.json?$select=*&$order=`:id`+ASC&$limit=8000&$offset=0&$where=(%60handelsbenaming%60%20%3D%20%27IONIQ5%27)&$$read_from_nbe=true&$$version=2.1"  # noqa
         errorstring = ""
         try:
-            request.urlretrieve(url, "x.kentekens")
-            return
-        except HTTPError as error:
-            errorstring = str(error.status) + ": " + error.reason
-        except URLError as error:
-            errorstring = str(error.reason)
+            status, reason, headers_, body = http_get(url, headers, parse)
+            if status == 304:
+                return None
+            if status == 200:
+                if response_headers is not None:
+                    response_headers.update(headers_)
+                return body
+            errorstring = f"{status}: {reason}"
         except TimeoutError:
             errorstring = "Request timed out"
-        except socket.timeout:
-            errorstring = "Socket timed out"
+        except (http.client.HTTPException, OSError) as error:
+            errorstring = f"{type(error).__name__}: {error}"
         except Exception as ex:  # pylint: disable=broad-except
-            errorstring = "urlopen exception: " + str(ex)
+            errorstring = "http exception: " + str(ex)
             traceback.print_exc()
 
-        log(f"RDW ERROR (retry after 1 minute): {errorstring} -> {url}")
-        time.sleep(60)  # retry after 1 minute
+        # exponential backoff with full jitter, but not beyond the deadline
+        delay = min(RDW_RETRY_MAX_DELAY, RDW_RETRY_DELAY * 2**retry)
+        delay = min(random.uniform(0, delay), deadline - time.monotonic())
+        if delay <= 0:
+            my_die(f"RDW ERROR (deadline passed): {errorstring} -> {url}")
+        log(f"RDW ERROR (retry after {delay:.1f} seconds): {errorstring} -> {url}")
+        time.sleep(delay)
+        retry += 1
+
+
+def get_kentekens_count(
+    filename: str, where: str, select: str, validators: dict, deadline: float
+) -> int:
+    """get number of rows matching where, -1 when snapshot filename is current"""
+    # conditional GET with the ETag/Last-Modified stored with the snapshot,
+    # the new ETag/Last-Modified are returned in validators
+    headers = {}
+    old_validators = read_validators(filename, where, select)
+    if "etag" in old_validators:
+        headers["If-None-Match"] = old_validators["etag"]
+    if "last_modified" in old_validators:
+        headers["If-Modified-Since"] = old_validators["last_modified"]
+    url = get_rdw_url(RDW_DATASET, {"$select": "count(*) AS count", "$where": where})
+    response_headers = {}
+    result = get_url_json(url, deadline, headers, response_headers)
+    if result is None:
+        return -1
+    validators["where"] = where
+    validators["select"] = select
+    if "ETag" in response_headers:
+        validators["etag"] = response_headers["ETag"]
+    if "Last-Modified" in response_headers:
+        validators["last_modified"] = response_headers["Last-Modified"]
+    return int(result[0]["count"])
+
+
+def read_validators(filename: str, where: str, select: str) -> dict:
+    """read ETag/Last-Modified stored with snapshot filename for where/select"""
+    if not os.path.isfile(filename) or not os.path.isfile(filename + ".headers"):
+        return {}
+    with open(filename + ".headers", encoding="utf8") as file:
+        validators = json.load(file)
+    if validators.get("where") != where or validators.get("select") != select:
+        return {}
+    return validators
+
+
+def write_validators(filename: str, validators: dict):
+    """write ETag/Last-Modified next to snapshot filename"""
+    with open(filename + ".headers", "w", encoding="utf8") as file:
+        json.dump(validators, file)
+
+
+def get_select(fields) -> str:
+    """get $select for fields, all fields when None"""
+    return ":id,:updated_at," + ("*" if fields is None else ",".join(fields))
+
+
+def get_rdw_rows(dataset: str, params: dict, deadline: float) -> list:
+    """get rows as json, or as csv (smaller, faster to parse) with argument csv"""
+    if arg_has("csv"):
+        return get_url_csv(get_rdw_url(dataset, params, "csv"), deadline)
+    return get_url_rows(get_rdw_url(dataset, params), deadline)
+
+
+def get_kentekens_page(where: str, select: str, offset: int, deadline: float) -> list:
+    """get one page of rows matching where, ordered on :id"""
+    params = {
+        "$select": select,
+        "$order": "`:id` ASC",
+        "$limit": RDW_PAGE_SIZE,
+        "$offset": offset,
+        "$where": where,
+    }
+    return get_rdw_rows(RDW_DATASET, params, deadline)
+
+
+def get_kentekens_after(where: str, select: str, last_id: str, deadline: float) -> list:
+    """get one page of rows matching where with :id after last_id (keyset)"""
+    params = {
+        "$select": select,
+        "$order": "`:id` ASC",
+        "$limit": RDW_PAGE_SIZE,
+        "$where": f"{where} AND `:id` > '{last_id}'",
+    }
+    return get_rdw_rows(RDW_DATASET, params, deadline)
+
+
+def open_kentekens(filename: str):
+    """open snapshot filename for reading, gzip compressed or not"""
+    with open(filename, "rb") as file:
+        magic = file.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(filename, "rt", encoding="utf8")
+    return open(filename, encoding="utf8")
+
+
+def iter_json_array(file, chunk_size: int = 65536):
+    """yield the elements of the json array in file one by one"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    more = " "
+    while buffer == "" and more != "":
+        more = file.read(chunk_size)
+        buffer = more.lstrip()
+    if not buffer.startswith("["):
+        raise ValueError(f"No json array: [{buffer[:80]}]")
+    pos = 1
+    eof = False
+    while True:
+        pos = JSON_SEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+            # a number can continue in the next chunk: need what follows too
+            if eof or (end < len(buffer) and buffer[end] in ", \t\n\r]"):
+                yield element
+                pos = end
+                continue
+        except json.JSONDecodeError:
+            if eof:
+                raise
+        # element not complete yet: read next chunk
+        more = file.read(chunk_size)
+        eof = more == ""
+        buffer = buffer[pos:] + more
+        pos = 0
+
+
+def project_kenteken(hash_: dict, fields) -> dict:
+    """keep only fields of kenteken, all fields when None"""
+    if fields is None:
+        return hash_
+    return {field: hash_[field] for field in fields if field in hash_}
+
+
+def iter_kentekens(filename: str, fields=None):
+    """yield kentekens of snapshot filename one by one, with only fields"""
+    with open_kentekens(filename) as file:
+        for hash_ in iter_json_array(file):
+            yield project_kenteken(hash_, fields)
+
+
+def write_kentekens(filename: str, kentekens, fields, watermark: str, compress: bool):
+    """write kentekens to snapshot filename and its watermark, yielding them"""
+    seen = set()
+    tmp_filename = filename + ".tmp"
+    if compress:
+        file = gzip.open(tmp_filename, "wt", encoding="utf8")
+    else:
+        file = open(tmp_filename, "w", encoding="utf8")
+    with file:
+        file.write("[")
+        for hash_ in kentekens:
+            if hash_["kenteken"] in seen:
+                continue  # deduplicate, first one wins
+            seen.add(hash_["kenteken"])
+            watermark = max(watermark, hash_.get(":updated_at", ""))
+            hash_ = project_kenteken(hash_, fields)
+            hash_.pop(":id", None)
+            hash_.pop(":updated_at", None)
+            if len(seen) > 1:
+                file.write(",")
+            json.dump(hash_, file)
+            yield hash_
+        file.write("]")
+    os.replace(tmp_filename, filename)
+    with open(filename + ".watermark", "w", encoding="utf8") as file:
+        json.dump({"updated_at": watermark}, file)
+
+
+def read_watermark(filename: str) -> str:
+    """read :updated_at watermark of snapshot filename, empty when unknown"""
+    if not os.path.isfile(filename) or not os.path.isfile(filename + ".watermark"):
+        return ""
+    with open(filename + ".watermark", encoding="utf8") as file:
+        return json.load(file)["updated_at"]
+
+
+def read_checkpoint(filename: str, header: dict) -> dict:
+    """read pages per offset completed by an earlier, interrupted run"""
+    pages = {}
+    checkpoint_filename = filename + ".checkpoint"
+    if os.path.isfile(checkpoint_filename):
+        with open(checkpoint_filename, encoding="utf8") as file:
+            if json.loads(file.readline() or "{}") == header:
+                for line in file:
+                    if line.endswith("\n"):  # skip partly written last page
+                        page = json.loads(line)
+                        pages[page["offset"]] = page["rows"]
+    if len(pages) > 0:
+        log(f"Resuming with {len(pages)} page(s) from {checkpoint_filename}")
+    else:
+        with open(checkpoint_filename, "w", encoding="utf8") as file:
+            file.write(json.dumps(header) + "\n")
+    return pages
+
+
+def append_checkpoint(filename: str, offset: int, rows: list):
+    """append completed page to checkpoint of filename"""
+    line = json.dumps({"offset": offset, "rows": rows}) + "\n"
+    with CHECKPOINT_LOCK, open(filename + ".checkpoint", "a", encoding="utf8") as file:
+        file.write(line)
+
+
+# == get_kentekens ==============================================================
+def get_kentekens(
+    filename: str = "x.kentekens",
+    where: str = RDW_WHERE,
+    fields=None,
+    compress: bool = False,
+):
+    """get_kentekens paginated and concurrent, yield them while writing filename"""
+    deadline = time.monotonic() + RDW_DEADLINE
+    select = get_select(fields)
+    validators = {}
+    count = get_kentekens_count(filename, where, select, validators, deadline)
+    if count < 0:
+        log(f"RDW not modified, reusing {filename}")
+        yield from iter_kentekens(filename, fields)
+        return
+    offsets = range(0, max(count, 1), RDW_PAGE_SIZE)
+    log(f"Getting {count} kentekens in {len(offsets)} page(s) for {filename}")
+
+    # pages already got before an interrupted run are taken from the checkpoint
+    checkpoint = read_checkpoint(filename, {**validators, "count": count})
+
+    def get_page(offset: int) -> list:
+        if offset in checkpoint:
+            return checkpoint[offset]
+        rows = get_kentekens_page(where, select, offset, deadline)
+        append_checkpoint(filename, offset, rows)
+        return rows
+
+    def iter_rows():
+        # pages are yielded in order as soon as they are there, with at most
+        # RDW_MAX_WORKERS pages requested ahead instead of all pages at once
+        todo = iter(offsets)
+        with ThreadPoolExecutor(max_workers=RDW_MAX_WORKERS) as executor:
+            pages = deque(
+                executor.submit(get_page, offset)
+                for offset in islice(todo, RDW_MAX_WORKERS)
+            )
+            while len(pages) > 0:
+                rows = pages.popleft().result()
+                for offset in islice(todo, 1):
+                    pages.append(executor.submit(get_page, offset))
+                last_id = rows[-1][":id"] if len(rows) > 0 else ""
+                yield from rows
+
+        # rows added after counting: walk on by :id keyset until a short page
+        while len(rows) == RDW_PAGE_SIZE:
+            rows = get_kentekens_after(where, select, last_id, deadline)
+            last_id = rows[-1][":id"] if len(rows) > 0 else ""
+            yield from rows
+
+    yield from write_kentekens(filename, iter_rows(), fields, "", compress)
+    write_validators(filename, validators)
+    os.remove(filename + ".checkpoint")
+
+
+# == get_kentekens_delta ========================================================
+def get_kentekens_delta(
+    filename: str = "x.kentekens",
+    where: str = RDW_WHERE,
+    fields=None,
+    compress: bool = False,
+):
+    """get only kentekens changed since the watermark, yield them merged"""
+    watermark = read_watermark(filename)
+    if watermark == "":
+        log("No watermark, getting all kentekens")
+        yield from get_kentekens(filename, where, fields, compress)
+        return
+    deadline = time.monotonic() + RDW_DEADLINE
+    select = get_select(fields)
+    validators = {}
+    count = get_kentekens_count(filename, where, select, validators, deadline)
+    if count < 0:
+        log(f"RDW not modified, reusing {filename}")
+        yield from iter_kentekens(filename, fields)
+        return
+
+    # >= instead of > to not miss rows updated within the same timestamp,
+    # the merge on kenteken makes fetching them again harmless
+    where_changed = f"{where} AND `:updated_at` >= '{watermark}'"
+    rows = get_kentekens_page(where_changed, select, 0, deadline)
+    changed = {}
+    while True:
+        for hash_ in rows:
+            changed[hash_["kenteken"]] = hash_
+        if len(rows) < RDW_PAGE_SIZE:
+            break
+        rows = get_kentekens_after(where_changed, select, rows[-1][":id"], deadline)
+    log(f"Getting {len(changed)} changed kentekens since {watermark}")
+    merged = {hash_["kenteken"] for hash_ in iter_kentekens(filename)}
+    merged.update(changed)
+    if len(merged) != count:
+        # deleted kentekens are not in the changed rows, only a full get drops them
+        log(f"Merged {len(merged)} kentekens instead of {count}, getting all")
+        yield from get_kentekens(filename, where, fields, compress)
+        return
+
+    def iter_merged():
+        for hash_ in iter_kentekens(filename):
+            yield changed.pop(hash_["kenteken"], hash_)
+        yield from changed.values()  # new kentekens
+
+    yield from write_kentekens(filename, iter_merged(), fields, watermark, compress)
+    write_validators(filename, validators)
+
+
+# == get_models =================================================================
+def get_model_filename(model: str) -> str:
+    """get snapshot filename for handelsbenaming model"""
+    if model == "IONIQ5":
+        return "x.kentekens"
+    return "x." + re.sub(r"\W+", "_", model) + ".kentekens"
+
+
+def get_model_where(model: str) -> str:
+    """get $where for handelsbenaming model"""
+    model = model.replace("'", "''")
+    return f"(`handelsbenaming` = '{model}')"
+
+
+async def get_models_async(models: list, fields, compress: bool, delta: bool):
+    """get kentekens of models concurrently, at most RDW_MAX_MODELS at once"""
+    semaphore = asyncio.Semaphore(RDW_MAX_MODELS)
+
+    def get_model(model: str) -> int:
+        filename = get_model_filename(model)
+        where = get_model_where(model)
+        if delta:
+            kentekens = get_kentekens_delta(filename, where, fields, compress)
+        else:
+            kentekens = get_kentekens(filename, where, fields, compress)
+        count = sum(1 for _ in kentekens)  # write snapshot
+        log(f"{model}: {count} kentekens in {filename}")
+        return count
+
+    async def get_model_limited(model: str) -> int:
+        async with semaphore:
+            return await asyncio.to_thread(get_model, model)
+
+    return await asyncio.gather(*(get_model_limited(model) for model in models))
+
+
+def get_models(models: list, fields=None, compress: bool = False, delta=False):
+    """get kentekens of several models concurrently, a snapshot per model"""
+    return asyncio.run(get_models_async(models, fields, compress, delta))
+
+
+# == get_enrichment =============================================================
+def read_enrichment(filename: str) -> dict:
+    """read enrichment cache: kenteken -> dataset -> rows"""
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, encoding="utf8") as file:
+        return json.load(file)
+
+
+def get_enrichment_batch(
+    dataset: str, fields: list, kentekens: list, deadline: float
+) -> list:
+    """get rows of companion dataset for a batch of kentekens"""
+    where = "`kenteken` IN (" + ",".join(f"'{k}'" for k in kentekens) + ")"
+    params = {
+        "$select": ",".join(fields),
+        "$where": where,
+        "$order": "`kenteken` ASC",
+        "$limit": RDW_PAGE_SIZE,
+    }
+    return get_rdw_rows(dataset, params, deadline)
+
+
+def get_enrichment(kentekens: list, filename: str = "x.enrichment") -> dict:
+    """join companion datasets by kenteken, only querying uncached kentekens"""
+    cache = read_enrichment(filename)
+    batches = []
+    for dataset, fields in RDW_ENRICH_DATASETS.items():
+        # kentekens without rows yet are queried again, RDW may fill them later
+        missing = [k for k in kentekens if dataset not in cache.get(k, {})]
+        for i in range(0, len(missing), RDW_ENRICH_BATCH_SIZE):
+            batches.append((dataset, fields, missing[i : i + RDW_ENRICH_BATCH_SIZE]))
+    log(f"Getting enrichment in {len(batches)} batch(es) for {filename}")
+    if len(batches) == 0:
+        return cache
+
+    deadline = time.monotonic() + RDW_DEADLINE
+
+    def get_batch(batch: tuple) -> tuple:
+        dataset, fields, batch_kentekens = batch
+        return dataset, get_enrichment_batch(dataset, fields, batch_kentekens, deadline)
+
+    with ThreadPoolExecutor(RDW_MAX_WORKERS) as executor:
+        for dataset, rows in executor.map(get_batch, batches):
+            for row in rows:
+                kenteken = row.pop("kenteken")
+                cache.setdefault(kenteken, {}).setdefault(dataset, []).append(row)
+
+    with open(filename + ".tmp", "w", encoding="utf8") as file:
+        json.dump(cache, file, separators=(",", ":"), sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+    return cache
 
 
 # ===============================================================================
@@ -69,6 +662,18 @@ def arg_has(string: str) -> bool:
     return False
 
 
+# ===============================================================================
+# arg_value
+# parameter 1: name of argument name=value
+# ===============================================================================
+def arg_value(name: str) -> str:
+    """value of argument name=value, empty when not given"""
+    for i in range(1, len(sys.argv)):
+        if sys.argv[i].lower().startswith(name + "="):
+            return sys.argv[i][len(name) + 1 :]
+    return ""
+
+
 # ===============================================================================
 # round5
 # parameter 1: integer number
@@ -82,6 +687,70 @@ def round5(number):
         return number - remainder + 5
 
 
+# == get_features ===============================================================
+FEATURE_AWD = 1 << 0
+FEATURE_PROJECT45 = 1 << 1
+FEATURE_MODEL2023 = 1 << 2
+FEATURE_MODEL2022_5 = 1 << 3
+FEATURE_58KWH = 1 << 4
+FEATURE_63KWH = 1 << 5
+FEATURE_V2L = 1 << 6
+FEATURE_WP = 1 << 7
+FEATURE_PANORAMADAK = 1 << 8
+FEATURE_OLIVE = 1 << 9
+FEATURE_ZONNEPANELEN = 1 << 10
+FEATURE_LOUNGE = 1 << 11
+FEATURE_CONNECTPLUS = 1 << 12
+FEATURE_CONNECT = 1 << 13
+FEATURE_STYLE = 1 << 14
+FEATURE_NLINEEDITION = 1 << 15
+FEATURE_NLINE = 1 << 16
+# (feature bit, token): the feature is in a print line when the token is,
+# case-insensitive, like the re.search(..., re.IGNORECASE) calls it replaces
+FEATURE_TOKENS = (
+    (FEATURE_AWD, "awd"),
+    (FEATURE_PROJECT45, "project45"),
+    (FEATURE_MODEL2023, "model 2023"),
+    (FEATURE_MODEL2022_5, "model 2022.5"),
+    (FEATURE_58KWH, "58 kwh"),
+    (FEATURE_63KWH, "63 kwh"),
+    (FEATURE_V2L, "v2l"),
+    (FEATURE_WP, "wp"),
+    (FEATURE_PANORAMADAK, "panoramadak"),
+    (FEATURE_ZONNEPANELEN, "zonnepanelen"),
+    (FEATURE_LOUNGE, "lounge"),
+    (FEATURE_CONNECTPLUS, "connect+"),
+    (FEATURE_CONNECT, "connect"),
+    (FEATURE_STYLE, "style"),
+    (FEATURE_NLINEEDITION, "n line edition"),
+    (FEATURE_NLINE, "n line"),
+)
+# trim level: the first feature found in this order
+FEATURE_TRIMS = (
+    (FEATURE_PROJECT45, "PROJECT45"),
+    (FEATURE_ZONNEPANELEN, "Zonnepanelen"),
+    (FEATURE_LOUNGE, "Lounge"),
+    (FEATURE_CONNECTPLUS, "Connect+"),
+    (FEATURE_CONNECT, "Connect"),
+    (FEATURE_STYLE, "Style"),
+    (FEATURE_NLINEEDITION, "N Line Edition"),
+    (FEATURE_NLINE, "N Line"),
+)
+
+
+def get_features(line: str) -> tuple:
+    """get (feature bits, trim level) of print line, trim empty when unknown"""
+    lower = line.lower()
+    features = FEATURE_OLIVE if "Olive" in line else 0  # case-sensitive
+    for feature, token in FEATURE_TOKENS:
+        if token in lower:
+            features |= feature
+    for feature, trim in FEATURE_TRIMS:
+        if features & feature:
+            return features, trim
+    return features, ""
+
+
 def print_import_separate(
     input_list: list,
     header_not_import: str,
@@ -634,56 +1303,23 @@ def find_variant_nearest(
     return result
 
 
+# remarks of a pricelist variant that are not counted as a separate variant:
+# price delta, pricelist, options and colours
+VARIANT_REMARKS = re.compile(
+    r"\$\(E[0-9]+ [a-z]+ dan prijslijst\)|\$"
+    r"| \(prijslijst [^)]+\)"
+    r"| \(1500 euro duurder\)| \(1495 euro duurder\)"
+    r"| zonder FCA-JX/HDA2"
+    r"| \(Digital Teal, Mystic Olive met Panoramadak\)"
+    r"| \(Olive\)| \(Shooting Star\)| \(Atlas White Matte\)"
+)
+
+
 def clean_variant(value, debug):
-    """clean_variant"""
-    stripped = value
+    """clean_variant of pricelist, before tyres, taxi, export and model are added"""
     if debug:
-        print(f"clean variant before: [{stripped}]")
-    stripped = re.sub(
-        r"\$\(E[0-9]+ [a-z]+ dan prijslijst\)", "", stripped
-    )  # exclude dollar and goedkoper/duurder
-    stripped = stripped.replace("$", "")  # exclude dollar in counting
-    stripped = re.sub(
-        r" \(model 202[^)]+\)", "", stripped, flags=re.IGNORECASE
-    )  # exclude model in counting
-    stripped = re.sub(
-        r" \(Taxi\)", "", stripped, flags=re.IGNORECASE
-    )  # exclude taxi in counting
-    stripped = re.sub(
-        r" \(geexporteerd\)", "", stripped, flags=re.IGNORECASE
-    )  # exclude geexporteerd in counting
-    stripped = re.sub(
-        r" \(prijslijst [^)]+\)", "", stripped, flags=re.IGNORECASE
-    )  # exclude prijslijst in counting
-    stripped = re.sub(
-        r" \(1500 euro duurder\)", "", stripped, flags=re.IGNORECASE
-    )  # exclude prijsinfo in counting
-    stripped = re.sub(
-        r" \(1495 euro duurder\)", "", stripped, flags=re.IGNORECASE
-    )  # exclude prijsinfo in counting
-    stripped = re.sub(
-        r" zonder FCA-JX/HDA2", "", stripped, flags=re.IGNORECASE
-    )  # exclude prijsinfo in counting
-    stripped = re.sub(
-        r" \(19 inch banden\)", "", stripped, flags=re.IGNORECASE
-    )  # exclude bandeninfo in counting
-    stripped = re.sub(
-        r" \(20 inch banden\)", "", stripped, flags=re.IGNORECASE
-    )  # exclude bandeninfo in counting
-    stripped = re.sub(
-        r" \(Digital Teal, Mystic Olive met Panoramadak\)",
-        "",
-        stripped,
-        flags=re.IGNORECASE,
-    )  # exclude colorinfo in counting
-    stripped = re.sub(r" \(Olive\)", "", stripped)  # exclude colorinfo in counting
-    stripped = re.sub(
-        r" \(Shooting Star\)", "", stripped
-    )  # exclude colorinfo in counting
-    stripped = re.sub(
-        r" \(Atlas White Matte\)", "", stripped
-    )  # exclude colorinfo in counting
-    stripped = stripped.rstrip()  # remove trailing spaces
+        print(f"clean variant before: [{value}]")
+    stripped = VARIANT_REMARKS.sub("", value).rstrip()
     if debug:
         print(f"clean variant after: [{stripped}]")
     return stripped
@@ -1054,6 +1690,7 @@ def get_variant(
             )
         value = found_variant
 
+    stripped = clean_variant(value, debug)  # counted without the remarks below
     if inch20:
         if "Lounge" not in value and "PROJECT45" not in value:
             value += " (20 inch banden)"
@@ -1117,7 +1754,6 @@ def get_variant(
     else:
         my_die(f"PROGRAMERROR: kleur {kleur} fout voor {kenteken}: {fulltype}")
 
-    stripped = clean_variant(value, debug)
     if stripped in variantscount:
         variantscount[stripped] += 1
     else: